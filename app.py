@@ -12,69 +12,55 @@ GitHub: https://github.com/prasunroy/ocr
 from __future__ import print_function
 
 import base64
+import json
+import logging
 import os
 import re
+import shutil
 import sys
+import tempfile
+import zipfile
+
+from collections import OrderedDict
 
 from flask import Flask
+from flask import Response
+from flask import jsonify
 from flask import render_template
 from flask import request
+from flask import stream_with_context
 
 import config
+import metrics
+
+from ocrlib import characters
+from ocrlib import ocr_result
+from ocrlib import ocr_bands
+from ocrlib import ocr_strokes
 
-from models import cnn
-from ocrlib import ocr
+from cache import GlyphCache
+from cache import ResultCache
+from registry import ModelRegistry
+from registry import engines as engine_specs
+from scan import extensions
+from scan import imread
+from scheduler import InferenceScheduler
 
 
 # setup environment
-model_en_numbers = cnn(config.i_shape, config.n_class_en_numbers)
-model_en_letters = cnn(config.i_shape, config.n_class_en_letters)
-model_bn_numbers = cnn(config.i_shape, config.n_class_bn_numbers)
-model_bn_letters = cnn(config.i_shape, config.n_class_bn_letters)
-model_dv_numbers = cnn(config.i_shape, config.n_class_dv_numbers)
-model_dv_letters = cnn(config.i_shape, config.n_class_dv_letters)
-
-if os.path.isfile(config.tfile_en_numbers):
-    model_en_numbers.model.load_weights(config.tfile_en_numbers)
-elif os.path.isfile(config.mfile_en_numbers):
-    model_en_numbers.model.load_weights(config.mfile_en_numbers)
-else:
-    print('[DEBUG] network weights not found for english numbers')
-
-if os.path.isfile(config.tfile_en_letters):
-    model_en_letters.model.load_weights(config.tfile_en_letters)
-elif os.path.isfile(config.mfile_en_letters):
-    model_en_letters.model.load_weights(config.mfile_en_letters)
-else:
-    print('[DEBUG] network weights not found for english letters')
-
-if os.path.isfile(config.tfile_bn_numbers):
-    model_bn_numbers.model.load_weights(config.tfile_bn_numbers)
-elif os.path.isfile(config.mfile_bn_numbers):
-    model_bn_numbers.model.load_weights(config.mfile_bn_numbers)
-else:
-    print('[DEBUG] network weights not found for bengali numbers')
-
-if os.path.isfile(config.tfile_bn_letters):
-    model_bn_letters.model.load_weights(config.tfile_bn_letters)
-elif os.path.isfile(config.mfile_bn_letters):
-    model_bn_letters.model.load_weights(config.mfile_bn_letters)
-else:
-    print('[DEBUG] network weights not found for bengali letters')
-
-if os.path.isfile(config.tfile_dv_numbers):
-    model_dv_numbers.model.load_weights(config.tfile_dv_numbers)
-elif os.path.isfile(config.mfile_dv_numbers):
-    model_dv_numbers.model.load_weights(config.mfile_dv_numbers)
-else:
-    print('[DEBUG] network weights not found for devanagari numbers')
-
-if os.path.isfile(config.tfile_dv_letters):
-    model_dv_letters.model.load_weights(config.tfile_dv_letters)
-elif os.path.isfile(config.mfile_dv_letters):
-    model_dv_letters.model.load_weights(config.mfile_dv_letters)
-else:
-    print('[DEBUG] network weights not found for devanagari letters')
+logger = logging.getLogger('ocr.app')
+
+# keep all candidate engines of 'auto' resident since it runs every one of
+# them per request and evicting any would reload engines on every request
+n_auto = len([e for e in config.auto_engines if e in engine_specs])
+if config.max_models < n_auto:
+    logger.warning('max_models %d is below the %d engines of auto, keeping '
+                   '%d engines resident', config.max_models, n_auto, n_auto)
+
+registry = ModelRegistry(max(config.max_models, n_auto))
+scheduler = InferenceScheduler(registry)
+cache = ResultCache()
+glyph_caches = {}
 
 if not os.path.isdir(config.dpath):
     os.makedirs(config.dpath)
@@ -89,10 +75,252 @@ for path in config.db_struct:
         if not os.path.isdir(label_path):
             os.makedirs(label_path)
 
-dfile = os.path.join(config.dpath, 'temp.png')
+segmentations = ['contour', 'histogram', 'stats']
+recognizers = list(engine_specs) + ['auto']
+archives = ['application/zip', 'application/x-zip-compressed']
 vinfo = sys.version_info[0]
 
 
+################################################################################
+
+# inference backend of an engine
+def backend_for(engine):
+    if config.batching:
+        return scheduler.get(engine)
+    
+    return registry.get(engine)
+
+# model of an engine behind the optional glyph cache (models of all candidate
+# engines for automatic recognition)
+def model_for(engine):
+    if engine == 'auto':
+        return OrderedDict((e, model_for(e)) for e in config.auto_engines
+                           if e in engine_specs)
+    
+    if config.glyph_cache_size <= 0 or engine not in engine_specs:
+        return backend_for(engine)
+    
+    if engine not in glyph_caches:
+        loader = lambda: backend_for(engine)
+        version = lambda: registry.version(engine)
+        glyph_caches[engine] = GlyphCache(loader, version=version, name=engine)
+    
+    return glyph_caches[engine]
+
+# version of the weights behind an engine including calibration of candidate
+# engines for automatic recognition
+def version_for(engine):
+    if engine == 'auto':
+        return '|'.join('{}={}:{}'.format(e, registry.version(e),
+                                          config.calibration.get(e, 1.0))
+                        for e in config.auto_engines if e in engine_specs)
+    
+    return registry.version(engine)
+
+# metric labels of known engines and segmentation modes only to bound their
+# cardinality
+def labels_for(engine, segmentation):
+    return (engine if engine in recognizers else 'unknown',
+            segmentation if segmentation in segmentations else 'unknown')
+
+# error of an unknown engine or segmentation mode or else None
+def invalid_options(engine, segmentation):
+    if engine not in recognizers:
+        return 'unknown recognition engine'
+    if segmentation not in segmentations:
+        return 'unknown segmentation mode'
+    
+    return None
+
+
+################################################################################
+
+# recognize an encoded image (or strokes with ocr_strokes) serving repeated
+# inputs from the result cache unless samples are saved, since a cache hit
+# skips recognition and with it the saving of samples
+def recognize_data(data, segmentation, engine, function=ocr_result):
+    cacheable = cache.enabled() and not config.db_saving \
+                and engine in recognizers and segmentation in segmentations
+    
+    if cacheable:
+        version = version_for(engine)
+        # strokes never share results with an image of the same bytes
+        mode = segmentation if function is ocr_result \
+            else 'strokes:' + segmentation
+        key = cache.key(data, mode, engine, version)
+        result = cache.get(key, engine, version)
+        if result is not None:
+            return result
+    
+    model = model_for(engine)
+    
+    result = function(model, data, segmentation, engine, debug=False)
+    
+    if cacheable:
+        cache.put(key, engine, version, result)
+    
+    return result
+
+
+# json error response of a request counted as a failure
+def failed(error, status, engine, segmentation):
+    metrics.failure(status, *labels_for(engine, segmentation))
+    
+    return jsonify({'error': error}), status
+
+# option of a request from its values or else from a header
+def request_option(name, header, default=None):
+    if name in request.values:
+        return request.values[name]
+    
+    return request.headers.get(header, default)
+
+# encoded image of a request posted as raw bytes in the body, as a multipart
+# file or as a base64 data url in a form field
+def request_image():
+    if request.mimetype == 'multipart/form-data' and 'image' in request.files:
+        return read_image(request.files['image'].stream)
+    
+    if request.mimetype in ['multipart/form-data',
+                            'application/x-www-form-urlencoded']:
+        with metrics.timer('base64_decode'):
+            return decode_base64(request.values['imageBase64'])
+    
+    # decoded by opencv straight from the bytes read off the request stream
+    return read_image(request.stream)
+
+# decode an image posted as a base64 data url
+def decode_base64(data):
+    data = re.sub('^data:image/.+;base64,', '', data)
+    
+    if vinfo == 2:
+        data = bytes(data)
+    else:
+        data = bytes(data, 'utf-8')
+    
+    # decode image in memory without a round trip through the filesystem
+    data = base64.b64decode(data)
+    
+    if vinfo == 2:
+        data = bytearray(data)
+    
+    return data
+
+
+################################################################################
+
+# read at most the maximum size of a batch image from a file object
+def read_image(file):
+    data = file.read(config.batch_image_size + 1)
+    if len(data) > config.batch_image_size:
+        raise ValueError('image exceeds {} bytes'
+                         .format(config.batch_image_size))
+    
+    if vinfo == 2:
+        data = bytearray(data)
+    
+    return data
+
+# reader of an item that cannot be read failing with the reason
+def unreadable(error):
+    def reader():
+        raise ValueError(error)
+    
+    return reader
+
+# items of a zip archive with settings overridden by an optional manifest
+# (an archive or manifest that cannot be read is one failing item)
+def zip_items(file, name, segmentation, engine):
+    try:
+        archive = zipfile.ZipFile(file)
+    except (zipfile.BadZipfile, ValueError) as e:
+        yield (name, unreadable('invalid zip archive: {}'.format(e)),
+               segmentation, engine)
+        return
+    
+    with archive:
+        names = archive.namelist()
+        manifest = {}
+        try:
+            if 'manifest.json' in names:
+                manifest = json.loads(archive.read('manifest.json')
+                                      .decode('utf-8'))
+            if not isinstance(manifest, dict):
+                raise ValueError('not an object of member names')
+        except (zipfile.BadZipfile, ValueError) as e:
+            yield (name, unreadable('invalid manifest.json: {}'.format(e)),
+                   segmentation, engine)
+            return
+        
+        for member_name in names:
+            if os.path.splitext(member_name)[1].lower() not in extensions:
+                continue
+            
+            options = manifest.get(member_name, {})
+            if not isinstance(options, dict):
+                yield (member_name, unreadable('invalid manifest entry'),
+                       segmentation, engine)
+                continue
+            
+            with archive.open(member_name) as member:
+                yield (member_name, lambda: read_image(member),
+                       options.get('segmentationMode', segmentation),
+                       options.get('recognitionEngine', engine))
+
+# items of a batch request as (name, reader, segmentation, engine) reading
+# one image at a time
+def batch_items():
+    segmentation = request.values.get('segmentationMode', 'contour')
+    engine = request.values.get('recognitionEngine', 'en-numbers')
+    
+    # zip archive as request body spooled to disk beyond a memory budget
+    if request.mimetype in archives:
+        with tempfile.SpooledTemporaryFile(config.batch_spool) as spool:
+            shutil.copyfileobj(request.stream, spool, 65536)
+            spool.seek(0)
+            for item in zip_items(spool, 'archive', segmentation, engine):
+                yield item
+        return
+    
+    # multipart parts which werkzeug spools to disk while parsing
+    for (field, part) in request.files.items(multi=True):
+        part_segmentation = request.values.get(field + '.segmentationMode',
+                                               segmentation)
+        part_engine = request.values.get(field + '.recognitionEngine', engine)
+        name = part.filename or field
+        
+        if name.lower().endswith('.zip') or part.mimetype in archives:
+            for item in zip_items(part.stream, name, part_segmentation,
+                                  part_engine):
+                yield item
+        else:
+            yield (name, lambda: read_image(part.stream), part_segmentation,
+                   part_engine)
+
+# recognize one item of a batch into a json serializable record
+def batch_record(index, name, reader, segmentation, engine):
+    record = {'index': index, 'name': name, 'engine': engine,
+              'segmentation': segmentation}
+    
+    error = invalid_options(engine, segmentation)
+    if error is not None:
+        record['error'] = error
+        return record
+    
+    with metrics.request(*labels_for(engine, segmentation)):
+        try:
+            data = reader()
+            result = recognize_data(data, segmentation, engine)
+        except Exception as e:
+            record['error'] = str(e) or e.__class__.__name__
+            return record
+    
+    record['text'] = result[0]
+    record['characters'] = characters(result)
+    
+    return record
+
+
 ################################################################################
 
 # create a flask application
@@ -106,39 +334,119 @@ def index():
 
 @app.route('/recognize', methods=['POST'])
 def recognize():
-    data = request.values['imageBase64']
-    data = re.sub('^data:image/.+;base64,', '', data)
+    segmentation = request_option('segmentationMode', 'X-Segmentation-Mode',
+                                  'contour')
+    engine = request_option('recognitionEngine', 'X-Recognition-Engine',
+                            'en-numbers')
     
-    if vinfo == 2:
-        data = bytes(data)
-    else:
-        data = bytes(data, 'utf-8')
+    error = invalid_options(engine, segmentation)
+    if error is not None:
+        return failed(error, 400, engine, segmentation)
     
-    with open(dfile, 'wb') as file:
-        file.write(base64.decodestring(data))
-    
-    segmentation = request.values['segmentationMode']
-    engine = request.values['recognitionEngine']
-    
-    if engine == 'en-numbers':
-        model = model_en_numbers
-    elif engine == 'en-letters':
-        model = model_en_letters
-    elif engine == 'bn-numbers':
-        model = model_bn_numbers
-    elif engine == 'bn-letters':
-        model = model_bn_letters
-    elif engine == 'dv-numbers':
-        model = model_dv_numbers
-    elif engine == 'dv-letters':
-        model = model_dv_letters
-    else:
-        model = None
+    with metrics.request(*labels_for(engine, segmentation)):
+        try:
+            data = request_image()
+            prediction = recognize_data(data, segmentation, engine)[0]
+        except ValueError as e:
+            # empty, undecodable or oversized images
+            return failed(str(e), 400, engine, segmentation)
+    
+    return prediction
+
+@app.route('/recognize/batch', methods=['POST'])
+def recognize_batch():
+    # stream one json line per image as soon as it is recognized
+    def generate():
+        for (index, item) in enumerate(batch_items()):
+            record = batch_record(index, *item)
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+@app.route('/recognize/page', methods=['POST'])
+def recognize_page():
+    segmentation = request_option('segmentationMode', 'X-Segmentation-Mode',
+                                  'contour')
+    engine = request_option('recognitionEngine', 'X-Recognition-Engine',
+                            'en-numbers')
+    
+    error = invalid_options(engine, segmentation)
+    if error is not None:
+        return failed(error, 400, engine, segmentation)
     
-    prediction = ocr(model, dfile, segmentation, engine, debug=False)[0]
+    # decode the page before streaming so that bad input is answered with a
+    # 400 status instead of an error record in a 200 stream
+    with metrics.request(*labels_for(engine, segmentation)):
+        try:
+            data = request_image()
+            with metrics.timer('image_decode'):
+                image_gray = imread(data, gray=True)
+        except ValueError as e:
+            # invalid base64, empty or oversized images
+            return failed(str(e), 400, engine, segmentation)
+    
+    if image_gray is None:
+        return failed('cannot decode image', 400, engine, segmentation)
+    
+    # stream one json line per band of lines in reading order as soon as it
+    # is recognized
+    def generate():
+        with metrics.request(*labels_for(engine, segmentation)):
+            try:
+                for (band, top, bottom, result) in ocr_bands(
+                        model_for(engine), image_gray, segmentation, engine):
+                    record = {'band': band, 'top': top, 'bottom': bottom,
+                              'text': result[0],
+                              'characters': characters(result)}
+                    yield json.dumps(record, ensure_ascii=False) + '\n'
+            except Exception as e:
+                record = {'error': str(e) or e.__class__.__name__}
+                yield json.dumps(record, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+@app.route('/recognize/strokes', methods=['POST'])
+def recognize_strokes():
+    segmentation = request_option('segmentationMode', 'X-Segmentation-Mode',
+                                  'contour')
+    engine = request_option('recognitionEngine', 'X-Recognition-Engine',
+                            'en-numbers')
+    
+    error = invalid_options(engine, segmentation)
+    if error is not None:
+        return failed(error, 400, engine, segmentation)
+    
+    # stroke polylines posted as json or in the binary stroke format
+    with metrics.request(*labels_for(engine, segmentation)):
+        try:
+            data = read_image(request.stream)
+            prediction = recognize_data(data, segmentation, engine,
+                                        ocr_strokes)[0]
+        except (ValueError, KeyError, TypeError) as e:
+            # malformed, truncated or oversized strokes
+            return failed(str(e) or e.__class__.__name__, 400, engine,
+                          segmentation)
     
     return prediction
 
+@app.route('/engines')
+def engines():
+    memory = registry.memory()
+    
+    hit_rates = dict((engine, glyph_cache.hit_rate())
+                     for (engine, glyph_cache) in glyph_caches.items())
+    
+    return jsonify({'capacity': registry.capacity,
+                    'loaded': list(memory.keys()),
+                    'memory': memory,
+                    'glyph_cache_hit_rates': hit_rates})
+
+@app.route('/metrics')
+def prometheus():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 
 ################################################################################
 
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+import asyncio
+import email.parser
+import email.policy
+import json
+import logging
+import mimetypes
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import config
+import metrics
+
+from app import decode_base64
+from app import invalid_options
+from app import labels_for
+from app import recognize_data
+from app import registry
+from ocrlib import ocr_result
+from ocrlib import ocr_strokes
+
+
+# setup environment
+# ---- files served from disk ----
+root = os.path.dirname(os.path.abspath(__file__))
+tpath = os.path.join(root, 'templates')
+spath = os.path.join(root, 'static')
+pages = {'/': 'index.html', '/index': 'index.html'}
+
+# ---- threads running recognition off the event loop ----
+executor = ThreadPoolExecutor(max_workers=config.asgi_workers)
+admission = {'semaphore': None, 'waiting': 0}
+
+# ---- failures logged through the server's logging setup ----
+logger = logging.getLogger('ocr.asgi')
+
+
+################################################################################
+
+# read a request body message by message without blocking the event loop
+# returning None if the client disconnects
+async def read_body(receive, limit):
+    chunks = []
+    size = 0
+    more_body = True
+    
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise ValueError('request body exceeds {} bytes'.format(limit))
+        
+        chunks.append(chunk)
+        more_body = message.get('more_body', False)
+    
+    return b''.join(chunks)
+
+
+# send a complete response
+async def respond(send, status, body,
+                  content_type='text/plain; charset=utf-8'):
+    await send({'type': 'http.response.start',
+                'status': status,
+                'headers': [(b'content-type', content_type.encode('latin-1')),
+                            (b'content-length',
+                             str(len(body)).encode('latin-1'))]})
+    await send({'type': 'http.response.body', 'body': body})
+    
+    return
+
+
+# send a json error counted as a failure of a request
+async def fail(send, status, error, engine=None, segmentation=None):
+    metrics.failure(status, *labels_for(engine, segmentation))
+    
+    await respond(send, status, json.dumps({'error': error}).encode('utf-8'),
+                  'application/json')
+    
+    return
+
+
+# header of a request or None
+def header(scope, name):
+    name = name.lower().encode('latin-1')
+    
+    for (key, value) in scope['headers']:
+        if key.lower() == name:
+            return value.decode('latin-1')
+    
+    return None
+
+
+# query and form values of a request like flask request.values and the
+# encoded image posted as raw body or multipart file (None for base64 forms)
+def form_values(scope, body):
+    values = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+    data = None
+    
+    content_type = header(scope, 'content-type') or ''
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        values.update(parse_qsl(body.decode('latin-1')))
+    elif content_type.startswith('multipart/form-data'):
+        parser = email.parser.BytesParser(policy=email.policy.HTTP)
+        message = parser.parsebytes(b'Content-Type: ' +
+                                    content_type.encode('latin-1') +
+                                    b'\r\n\r\n' + body)
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename() is not None:
+                if name == 'image':
+                    data = part.get_payload(decode=True)
+            elif name is not None:
+                values[name] = part.get_content()
+    else:
+        data = body
+    
+    # options missing from values may be passed as headers
+    for (name, key) in [('segmentationMode', 'x-segmentation-mode'),
+                        ('recognitionEngine', 'x-recognition-engine')]:
+        if name not in values and header(scope, key) is not None:
+            values[name] = header(scope, key)
+    
+    return [values, data]
+
+
+# read a file below a directory refusing paths that escape it
+def read_file(directory, name):
+    path = os.path.normpath(os.path.join(directory, name))
+    if not path.startswith(directory + os.sep) or not os.path.isfile(path):
+        return None
+    
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+################################################################################
+
+# run a function on the recognition threads admitting only as many jobs as
+# there are threads so that waiting requests hold no thread or decoded image
+async def run(function, *args):
+    if admission['semaphore'] is None:
+        admission['semaphore'] = asyncio.Semaphore(config.asgi_workers)
+    
+    admission['waiting'] += 1
+    try:
+        async with admission['semaphore']:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(executor, function, *args)
+    finally:
+        admission['waiting'] -= 1
+
+
+# engine and segmentation mode of query and form values
+def options(values):
+    return (values.get('recognitionEngine', 'en-numbers'),
+            values.get('segmentationMode', 'contour'))
+
+
+# recognize an encoded image (or strokes with ocr_strokes) or else a base64
+# form value on a recognition thread
+def recognize_values(values, data=None, function=ocr_result):
+    (engine, segmentation) = options(values)
+    
+    with metrics.request(*labels_for(engine, segmentation)):
+        if data is None:
+            with metrics.timer('base64_decode'):
+                data = decode_base64(values['imageBase64'])
+        
+        return recognize_data(data, segmentation, engine, function)[0]
+
+
+################################################################################
+
+# serve a file of a directory
+async def serve_file(send, directory, name):
+    loop = asyncio.get_event_loop()
+    body = await loop.run_in_executor(None, read_file, directory, name)
+    
+    if body is None:
+        await respond(send, 404, b'not found')
+        return
+    
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type.endswith('script'):
+        content_type += '; charset=utf-8'
+    
+    await respond(send, 200, body, content_type)
+    
+    return
+
+
+# recognize an image posted as raw bytes, as a multipart file or as a base64
+# data url (or strokes posted as raw bytes with ocr_strokes)
+async def recognize(scope, receive, send, function=ocr_result):
+    try:
+        body = await read_body(receive, config.asgi_body_size)
+    except ValueError as e:
+        await fail(send, 413, str(e))
+        return
+    
+    # nothing to answer once the client is gone
+    if body is None:
+        return
+    
+    try:
+        [values, data] = form_values(scope, body)
+    except Exception:
+        await fail(send, 400, 'malformed request body')
+        return
+    del body
+    
+    (engine, segmentation) = options(values)
+    error = invalid_options(engine, segmentation)
+    if error is None and data is None and 'imageBase64' not in values:
+        error = 'missing image'
+    if error is not None:
+        await fail(send, 400, error, engine, segmentation)
+        return
+    
+    if admission['waiting'] >= config.asgi_queue:
+        await fail(send, 503, 'server busy', engine, segmentation)
+        return
+    
+    try:
+        prediction = await run(recognize_values, values, data, function)
+    except (ValueError, KeyError, TypeError) as e:
+        # empty, undecodable or oversized images and malformed strokes
+        await fail(send, 400, str(e) or e.__class__.__name__, engine,
+                   segmentation)
+        return
+    except Exception:
+        logger.exception('recognition failed')
+        await fail(send, 500, 'internal server error', engine, segmentation)
+        return
+    
+    await respond(send, 200, prediction.encode('utf-8'),
+                  'text/html; charset=utf-8')
+    
+    return
+
+
+# load engines listed in config.preload before serving
+async def lifespan(receive, send):
+    loop = asyncio.get_event_loop()
+    
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            for engine in config.preload:
+                await loop.run_in_executor(executor, registry.get, engine)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+################################################################################
+
+# asgi application
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    
+    if scope['type'] != 'http':
+        return
+    
+    path = scope['path']
+    method = scope['method']
+    
+    if path in pages and method in ['GET', 'HEAD']:
+        await serve_file(send, tpath, pages[path])
+    elif path.startswith('/static/') and method in ['GET', 'HEAD']:
+        await serve_file(send, spath, path[len('/static/'):])
+    elif path == '/recognize' and method == 'POST':
+        await recognize(scope, receive, send)
+    elif path == '/recognize/strokes' and method == 'POST':
+        await recognize(scope, receive, send, ocr_strokes)
+    else:
+        await respond(send, 404, b'not found')
+    
+    return
+
+
+################################################################################
+
+# main
+if __name__ == '__main__':
+    import uvicorn
+    
+    uvicorn.run(app, host=config._host or '127.0.0.1',
+                port=config._port or 5000)
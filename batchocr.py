@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+try:
+    from queue import Empty
+    from queue import Queue
+except ImportError:
+    from Queue import Empty
+    from Queue import Queue
+
+import config
+
+from registry import engines
+from server import limit_threads
+
+
+# setup environment
+vinfo = sys.version_info[0]
+
+# ---- model of the current worker process ----
+worker = {}
+
+# ---- seconds between checks of worker processes while waiting ----
+poll = 1.0
+
+
+################################################################################
+
+# walk a directory tree lazily yielding images in a stable order
+def walk(root):
+    from scan import extensions
+    
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in extensions:
+                yield os.path.join(dirpath, filename)
+
+
+################################################################################
+
+# read finished files from an output file dropping a partially written line
+# (files that failed count as finished unless they are retried)
+def checkpoint(output, retry_errors=False):
+    done = set()
+    
+    if not os.path.isfile(output):
+        return done
+    
+    offset = 0
+    with io.open(output, 'rb') as file:
+        for line in file:
+            try:
+                record = json.loads(line.decode('utf-8'))
+                if retry_errors and 'error' in record:
+                    done.discard(record['path'])
+                else:
+                    done.add(record['path'])
+            except (ValueError, KeyError, TypeError):
+                break
+            offset += len(line)
+    
+    # truncate an interrupted write so that appended lines stay parseable
+    if offset < os.path.getsize(output):
+        with io.open(output, 'r+b') as file:
+            file.truncate(offset)
+            if offset > 0:
+                file.seek(offset - 1)
+                if file.read(1) != b'\n':
+                    file.write(b'\n')
+    
+    return done
+
+
+################################################################################
+
+# load the model of an engine (or of all candidate engines) once per worker
+# process keeping the reason if it fails since a pool replaces workers whose
+# initializer raises forever
+def init(engine, segmentation):
+    from registry import ModelRegistry
+    
+    worker['engine'] = engine
+    worker['segmentation'] = segmentation
+    
+    try:
+        if engine == 'auto':
+            registry = ModelRegistry(capacity=len(engines))
+            worker['model'] = dict((e, registry.get(e))
+                                   for e in config.auto_engines
+                                   if e in engines)
+        else:
+            worker['model'] = ModelRegistry(capacity=1).get(engine)
+    except Exception as e:
+        worker['error'] = 'cannot load {}: {}'.format(
+                engine, str(e) or e.__class__.__name__)
+    
+    return
+
+
+# recognize one file in a worker process
+def recognize_file(item):
+    from ocrlib import characters
+    from ocrlib import ocr_result
+    
+    (path, name) = item
+    record = {'path': name}
+    
+    try:
+        result = ocr_result(worker['model'], path, worker['segmentation'],
+                            worker['engine'])
+    except Exception as e:
+        record['error'] = str(e) or e.__class__.__name__
+        return record
+    
+    record['text'] = result[0]
+    record['characters'] = characters(result)
+    
+    return record
+
+
+# recognize a chunk of files in a worker process
+def recognize_chunk(chunk):
+    if 'error' in worker:
+        raise RuntimeError(worker['error'])
+    
+    return [recognize_file(item) for item in chunk]
+
+
+# process ids of the live worker processes of this process
+def worker_pids():
+    return set(p.pid for p in multiprocessing.active_children())
+
+
+################################################################################
+
+# recognize all images under a directory appending results to an output file
+def run(root, output, engine, segmentation, n_workers, chunk_size,
+        report=5.0, retry_errors=False):
+    done = checkpoint(output, retry_errors)
+    if done:
+        print('[DEBUG] resuming after {} finished files'.format(len(done)),
+              file=sys.stderr)
+    
+    # pending files relative to the root as keys of the checkpoint
+    items = ((path, os.path.relpath(path, root)) for path in walk(root))
+    items = (item for item in items if item[1] not in done)
+    
+    pool = multiprocessing.Pool(n_workers, init, (engine, segmentation))
+    workers = worker_pids()
+    chunks = iter(lambda: list(itertools.islice(items, chunk_size)), [])
+    results = Queue()
+    
+    # failed chunks are queued as their exception (python 2 has no error
+    # callback, which is covered by the worker check below)
+    callbacks = {'callback': results.put}
+    if vinfo > 2:
+        callbacks['error_callback'] = results.put
+    
+    # submit a chunk returning whether the walk had one left
+    def submit():
+        for chunk in itertools.islice(chunks, 1):
+            pool.apply_async(recognize_chunk, (chunk,), **callbacks)
+            return True
+        return False
+    
+    n_files = 0
+    t_start = time.time()
+    t_report = t_start
+    
+    try:
+        with io.open(output, 'ab') as file:
+            # keep a bounded number of chunks in flight refilling one as each
+            # finishes so that workers never wait on the slowest of a window
+            # and the walk never runs far ahead of them
+            n_pending = sum(submit() for _ in range(n_workers * 4))
+            
+            while n_pending > 0:
+                # a pool silently replaces a worker that died (for instance
+                # killed out of memory) and its chunk never completes
+                try:
+                    records = results.get(timeout=poll)
+                except Empty:
+                    if worker_pids() - workers:
+                        raise RuntimeError('a worker process died, rerun to '
+                                           'resume after finished files')
+                    continue
+                
+                if isinstance(records, Exception):
+                    raise records
+                n_pending -= 1
+                n_pending += submit()
+                
+                for record in records:
+                    line = json.dumps(record, ensure_ascii=False) + '\n'
+                    file.write(line.encode('utf-8'))
+                    n_files += 1
+                file.flush()
+                
+                t_now = time.time()
+                if t_now - t_report >= report:
+                    print('[DEBUG] {} files {:.1f} files/sec'
+                          .format(n_files, n_files / (t_now - t_start)),
+                          file=sys.stderr)
+                    t_report = t_now
+    finally:
+        pool.terminate()
+        pool.join()
+    
+    t_total = max(time.time() - t_start, 1e-9)
+    print('[DEBUG] {} files in {:.1f} sec {:.1f} files/sec'
+          .format(n_files, t_total, n_files / t_total), file=sys.stderr)
+    
+    return n_files
+
+
+################################################################################
+
+# main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='recognize images under a '
+                                     'directory into a jsonl file')
+    parser.add_argument('root', help='directory of images')
+    parser.add_argument('--output', default='results.jsonl',
+                        help='jsonl file of results that is also the '
+                             'checkpoint of an interrupted run')
+    parser.add_argument('--engine', default='en-numbers',
+                        choices=list(engines) + ['auto'])
+    parser.add_argument('--segmentation', default='contour',
+                        choices=['contour', 'histogram', 'stats'])
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: number of cores)')
+    parser.add_argument('--threads', type=int, default=config.n_threads,
+                        help='blas/openmp threads per worker')
+    parser.add_argument('--chunk-size', type=int, default=16,
+                        help='files sent to a worker at a time')
+    parser.add_argument('--retry-errors', action='store_true',
+                        help='recognize files that failed in an earlier run '
+                             'again')
+    args = parser.parse_args()
+    
+    # limit threads before workers load numerical libraries
+    limit_threads(args.threads)
+    
+    try:
+        run(args.root, args.output, args.engine, args.segmentation,
+            args.workers or multiprocessing.cpu_count(), args.chunk_size,
+            retry_errors=args.retry_errors)
+    except RuntimeError as e:
+        sys.exit('batch aborted: {}'.format(e))
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scan import imscan_cols
+from scan import imscan_rows
+
+
+################################################################################
+
+# reference scanner along rows (element-wise python loop)
+def imscan_rows_loop(image, line_space_threshold=16):
+    im_rows = image.shape[0]
+    accu_rows = numpy.sum(image, axis=1, dtype='int') // 255
+    
+    zero_samp = 0
+    y_samples = []
+    
+    for row in range(im_rows):
+        if accu_rows[row] == 0:
+            zero_samp += 1
+        elif zero_samp >= line_space_threshold:
+            y_samples.append(row - zero_samp // 2)
+            zero_samp = 0
+        elif len(y_samples) == 0:
+            y_samples.append(0)
+            zero_samp = 0
+    
+    y_samples.append(im_rows - zero_samp // 2)
+    
+    return [accu_rows, y_samples]
+
+
+# reference scanner along columns (element-wise python loop)
+def imscan_cols_loop(image, y_samples=[], word_space_threshold=8):
+    im_cols = image.shape[1]
+    n_lines = len(y_samples) - 1
+    
+    accu_cols_list = []
+    
+    for line in range(n_lines):
+        accu_cols = numpy.sum(image[y_samples[line]:y_samples[line+1], :],
+                              axis=0, dtype='int') // 255
+        accu_cols_list.append(accu_cols)
+    
+    x_samples_list = []
+    
+    for accu_cols in accu_cols_list:
+        zero_samp = 0
+        x_samples = []
+        
+        for col in range(im_cols):
+            if accu_cols[col] == 0:
+                zero_samp += 1
+            elif zero_samp >= word_space_threshold:
+                x_samples.append(col - zero_samp // 2)
+                zero_samp = 0
+            elif len(x_samples) == 0:
+                x_samples.append(0)
+                zero_samp = 0
+        
+        x_samples.append(im_cols - zero_samp // 2)
+        x_samples_list.append(x_samples)
+    
+    return [accu_cols_list, x_samples_list]
+
+
+################################################################################
+
+# synthetic thresholded page with lines of glyph-like blobs
+def synthetic_page(height, width, seed=0):
+    random = numpy.random.RandomState(seed)
+    image = numpy.zeros((height, width), dtype='uint8')
+    
+    y = random.randint(0, 60)
+    while y < height - 40:
+        h = min(random.randint(20, 60), height - y)
+        x = random.randint(0, 60)
+        while x < width - 40:
+            w = random.randint(8, 40)
+            image[y:y+h, x:x+w] = 255 * (random.rand(h, w) > 0.4)
+            x += w + random.randint(1, 24)
+        y += h + random.randint(4, 40)
+    
+    return image
+
+
+################################################################################
+
+# main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark histogram scans')
+    parser.add_argument('--height', type=int, default=5600)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    
+    image = synthetic_page(args.height, args.width)
+    
+    # verify that both scanners produce identical samples
+    [_, y_loop] = imscan_rows_loop(image)
+    [_, x_loop] = imscan_cols_loop(image, y_loop)
+    [_, y_fast] = imscan_rows(image)
+    [_, x_fast] = imscan_cols(image, y_fast)
+    
+    assert y_loop == y_fast, 'samples along y differ'
+    assert x_loop == x_fast, 'samples along x differ'
+    
+    # time both scanners
+    t_loop = min(timeit.repeat(lambda: imscan_cols_loop(image,
+                                                        imscan_rows_loop(image)[1]),
+                               number=1, repeat=args.repeat))
+    t_fast = min(timeit.repeat(lambda: imscan_cols(image,
+                                                   imscan_rows(image)[1]),
+                               number=1, repeat=args.repeat))
+    
+    print('page {}x{} with {} lines'.format(args.width, args.height,
+                                            len(y_fast) - 1))
+    print('loop scan...................... {:.4f} s'.format(t_loop))
+    print('vectorized scan................ {:.4f} s'.format(t_fast))
+    print('speedup........................ {:.1f}x'.format(t_loop / t_fast))
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import base64
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import config
+
+from ocrlib import normalize
+from ocrlib import predict
+from ocrlib import resize_and_pad_image
+from scan import imread
+from scan import impreprocess
+from scan import imscanC
+from scan import imscanH
+from scan import imscanS
+from synth import synthesize
+
+
+# setup environment
+# ---- high resolution timer ----
+clock = getattr(time, 'perf_counter', time.time)
+
+
+################################################################################
+
+# time a function over repeated runs
+def measure(function, repeat):
+    times = []
+    result = None
+    
+    for _ in range(repeat):
+        t0 = clock()
+        result = function()
+        times.append(clock() - t0)
+    
+    times = numpy.array(times)
+    stats = {'n': int(repeat),
+             'min': float(times.min()),
+             'mean': float(times.mean()),
+             'median': float(numpy.median(times)),
+             'max': float(times.max())}
+    
+    return [stats, result]
+
+
+################################################################################
+
+# describe the environment of a run
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=root, stderr=subprocess.STDOUT)
+        commit = commit.decode('utf8').strip()
+    except Exception:
+        commit = None
+    
+    return {'commit': commit,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'opencv': cv2.__version__,
+            'backend': config.backend,
+            'machine': platform.machine(),
+            'processor': platform.processor()}
+
+
+################################################################################
+
+# benchmark all stages on one page
+def bench_page(page, engine, segmentation, client, model, repeat, tmpdir):
+    stages = {}
+    
+    # encode page as the web client would
+    (_, data) = cv2.imencode('.png', page)
+    data = data.tobytes()
+    path = os.path.join(tmpdir, 'bench.png')
+    with open(path, 'wb') as file:
+        file.write(data)
+    
+    # scanning stages
+    [stages['imread_file'], _] = measure(lambda: imread(path), repeat)
+    [stages['imread_buffer'], image] = measure(lambda: imread(data), repeat)
+    [stages['impreprocess'], _] = measure(lambda: impreprocess(image), repeat)
+    [stages['imscanH'], _] = measure(lambda: imscanH(data), repeat)
+    [stages['imscanC'], scans] = measure(lambda: imscanC(data), repeat)
+    [stages['imscanS'], _] = measure(lambda: imscanS(data), repeat)
+    [stages['imscanH_plain'], _] = measure(
+            lambda: imscanH(data, annotate=False), repeat)
+    [stages['imscanC_plain'], _] = measure(
+            lambda: imscanC(data, annotate=False), repeat)
+    [stages['imscanS_plain'], _] = measure(
+            lambda: imscanS(data, annotate=False), repeat)
+    
+    if segmentation == 'histogram':
+        scans = imscanH(data)
+    elif segmentation == 'stats':
+        scans = imscanS(data)
+    image_rois = scans[1]
+    
+    # normalization stage
+    [stages['resize_and_pad_image'], _] = measure(
+            lambda: [resize_and_pad_image(image_roi)
+                     for image_roi in image_rois], repeat)
+    
+    # prediction stage
+    if model is not None:
+        images = normalize(image_rois)[0]
+        [stages['predict'], _] = measure(lambda: predict(model, images),
+                                         repeat)
+    
+    # end-to-end request
+    if client is not None:
+        form = {'imageBase64': 'data:image/png;base64,' +
+                base64.b64encode(data).decode('ascii'),
+                'segmentationMode': segmentation,
+                'recognitionEngine': engine}
+        [stages['recognize'], _] = measure(
+                lambda: client.post('/recognize', data=form), repeat)
+    
+    return {'height': int(page.shape[0]),
+            'width': int(page.shape[1]),
+            'bytes': len(data),
+            'rois': len(image_rois),
+            'stages': stages}
+
+
+################################################################################
+
+# main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark OCR stages')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='json file with results')
+    parser.add_argument('--engine', default='en-numbers')
+    parser.add_argument('--segmentation', default='contour',
+                        choices=['contour', 'histogram', 'stats'])
+    parser.add_argument('--lines', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--chars', type=int, default=16)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 96])
+    parser.add_argument('--noise', type=float, nargs='+', default=[0.0, 0.05])
+    parser.add_argument('--font', default=None,
+                        help='truetype font for bengali or devanagari')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--no-model', action='store_true',
+                        help='skip prediction and end-to-end stages')
+    args = parser.parse_args()
+    
+    # load model and flask test client
+    client = None
+    model = None
+    
+    if not args.no_model:
+        os.chdir(root)
+        from app import app
+        from app import cache
+        from app import registry
+        client = app.test_client()
+        model = registry.get(args.engine)
+        
+        # repeats of the end-to-end request would otherwise be cache hits
+        cache.capacity = 0
+        cache.path = None
+    
+    # benchmark pages of varied sizes, line counts and noise levels
+    tmpdir = os.path.join(root, config.dpath)
+    if not os.path.isdir(tmpdir):
+        os.makedirs(tmpdir)
+    
+    results = []
+    seed = 0
+    
+    for n_lines in args.lines:
+        for size in args.sizes:
+            for noise in args.noise:
+                [page, _] = synthesize(args.engine, n_lines, args.chars,
+                                       (size, size + size // 2), noise,
+                                       args.font, seed)
+                result = bench_page(page, args.engine, args.segmentation,
+                                    client, model, args.repeat, tmpdir)
+                result.update({'lines': n_lines, 'size': size,
+                               'noise': noise, 'seed': seed})
+                results.append(result)
+                seed += 1
+                
+                print('lines {:3d} size {:3d} noise {:.2f} rois {:4d} '
+                      '{}'.format(n_lines, size, noise, result['rois'],
+                                  ' '.join('{}={:.4f}'.format(k, v['median'])
+                                           for (k, v) in
+                                           sorted(result['stages'].items()))))
+    
+    with open(args.output, 'w') as file:
+        json.dump({'environment': environment(),
+                   'engine': args.engine,
+                   'segmentation': args.segmentation,
+                   'results': results}, file, indent=2, sort_keys=True)
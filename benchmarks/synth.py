@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+import cv2
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mapper
+
+
+# setup environment
+# ---- character tables of recognition engines ----
+tables = {'en-numbers': [chr(c) for c in mapper.map2ascii_en_numbers.values()],
+          'en-letters': [chr(c) for c in mapper.map2ascii_en_letters.values()],
+          'bn-numbers': list(mapper.map2unicode_bn_numbers.values()),
+          'bn-letters': list(mapper.map2unicode_bn_letters.values()),
+          'dv-numbers': list(mapper.map2unicode_dv_numbers.values()),
+          'dv-letters': list(mapper.map2unicode_dv_letters.values())}
+
+# ---- canvas colors of the web client (bgr) ----
+background = (165, 240, 255)
+foreground = (0, 0, 0)
+
+# ---- hershey fonts resembling handwriting ----
+fonts = [cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX,
+         cv2.FONT_HERSHEY_COMPLEX, cv2.FONT_HERSHEY_SCRIPT_SIMPLEX]
+
+
+################################################################################
+
+# render a character with opencv hershey fonts (ascii only)
+def render_hershey(page, char, x, y, size, random):
+    font = fonts[random.randint(len(fonts))]
+    scale = cv2.getFontScaleFromHeight(font, size) \
+        if hasattr(cv2, 'getFontScaleFromHeight') else size / 22.0
+    thickness = max(1, size // 12)
+    ((w, h), _) = cv2.getTextSize(char, font, scale, thickness)
+    cv2.putText(page, char, (x, y + h), font, scale, foreground, thickness,
+                cv2.LINE_AA)
+    
+    return w
+
+
+# render a character with a truetype font (any script)
+def render_truetype(page, char, x, y, size, font):
+    from PIL import Image
+    from PIL import ImageDraw
+    from PIL import ImageFont
+    
+    face = ImageFont.truetype(font, size)
+    (x0, y0, x1, y1) = face.getbbox(char)
+    (w, h) = (x1 - x0 + 2, y1 - y0 + 2)
+    (w, h) = (min(w, page.shape[1] - x), min(h, page.shape[0] - y))
+    
+    glyph = Image.new('L', (w, h), 0)
+    ImageDraw.Draw(glyph).text((-x0 + 1, -y0 + 1), char, fill=255, font=face)
+    alpha = numpy.asarray(glyph, dtype='float32')[:, :, None] / 255.0
+    
+    region = page[y:y+h, x:x+w].astype('float32')
+    region = region * (1.0 - alpha) + numpy.float32(foreground) * alpha
+    page[y:y+h, x:x+w] = region.astype('uint8')
+    
+    return w
+
+
+################################################################################
+
+# synthesize a page of characters of an engine
+def synthesize(engine='en-numbers', n_lines=4, n_chars=12, size=(40, 80),
+               noise=0.0, font=None, seed=0):
+    random = numpy.random.RandomState(seed)
+    
+    # fall back to english numbers for unicode scripts without a font
+    if font is None and not engine.startswith('en-'):
+        print('[DEBUG] no truetype font for {}, using en-numbers'
+              .format(engine))
+        engine = 'en-numbers'
+    
+    table = tables[engine]
+    sizes = random.randint(size[0], size[1] + 1, size=(n_lines, n_chars))
+    width = int(sizes.max(axis=0).sum() * 1.3) + 2 * size[1]
+    height = int(sizes.max(axis=1).sum() * 1.6) + 2 * size[1]
+    
+    page = numpy.empty((height, width, 3), dtype='uint8')
+    page[:, :] = background
+    
+    # render lines of characters with random gaps
+    truth = []
+    y = size[1] // 2
+    
+    for line in range(n_lines):
+        x = size[1] // 2
+        text = []
+        
+        for i in range(n_chars):
+            char = table[random.randint(len(table))]
+            if font is None:
+                w = render_hershey(page, char, x, y, sizes[line, i], random)
+            else:
+                w = render_truetype(page, char, x, y, sizes[line, i], font)
+            x += w + random.randint(size[0] // 8 + 1, size[0] // 2 + 2)
+            text.append(char)
+        
+        truth.append(''.join(text))
+        y += int(sizes[line].max() * 1.6)
+    
+    # add gaussian noise and salt-and-pepper speckles
+    if noise > 0:
+        page = page.astype('float32')
+        page += random.normal(0, 255 * noise, size=page.shape)
+        speckles = random.rand(height, width) < noise / 20.0
+        page[speckles] = random.choice([0, 255], size=(speckles.sum(), 1))
+        page = numpy.clip(page, 0, 255).astype('uint8')
+    
+    return [page, truth]
+
+
+################################################################################
+
+# main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='synthesize a test page')
+    parser.add_argument('output')
+    parser.add_argument('--engine', default='en-numbers', choices=tables)
+    parser.add_argument('--lines', type=int, default=4)
+    parser.add_argument('--chars', type=int, default=12)
+    parser.add_argument('--size', type=int, nargs=2, default=(40, 80))
+    parser.add_argument('--noise', type=float, default=0.0)
+    parser.add_argument('--font', default=None,
+                        help='truetype font for bengali or devanagari')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    [page, truth] = synthesize(args.engine, args.lines, args.chars,
+                               tuple(args.size), args.noise, args.font,
+                               args.seed)
+    cv2.imwrite(args.output, page)
+    print('\n'.join(truth))
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy
+
+import config
+
+from npmodels import cnn
+from registry import ModelRegistry
+from registry import engines
+
+
+# setup environment
+# ---- file layout ----
+# magic, header length, json header, tensors aligned to 64 bytes
+magic = b'OCRWB\x00\x01\x00'
+alignment = 64
+dtypes = ['float32', 'float16', 'int8']
+
+# ---- bundles mapped by the current process ----
+mapped = {}
+lock = threading.Lock()
+
+
+################################################################################
+
+# pad a length up to the alignment
+def align(n):
+    return (n + alignment - 1) // alignment * alignment
+
+
+# encode a tensor in a storage type returning its bytes and scales
+def encode(weight, dtype):
+    if dtype == 'float32' or weight.ndim == 1:
+        return [numpy.ascontiguousarray(weight, dtype='float32'), None]
+    
+    if dtype == 'float16':
+        return [numpy.ascontiguousarray(weight, dtype='float16'), None]
+    
+    # symmetric int8 quantization with one scale per output channel
+    axes = tuple(range(weight.ndim - 1))
+    scales = numpy.abs(weight).max(axis=axes) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = numpy.clip(numpy.round(weight / scales), -127, 127)
+    
+    return [quantized.astype('int8'), scales.astype('float32')]
+
+
+# decode a stored tensor into float32 sharing memory where possible
+def decode(data, entry):
+    if entry['dtype'] == 'float32':
+        return data
+    
+    weight = data.astype('float32')
+    if entry.get('scales') is not None:
+        weight *= numpy.array(entry['scales'], dtype='float32')
+    
+    return weight
+
+
+################################################################################
+
+# write weights of engines into one bundle in forward-ready layout
+def export(path, engine_list, dtype='float32'):
+    registry = ModelRegistry()
+    header = {'version': 1, 'engines': {}}
+    tensors = []
+    offset = 0
+    
+    for engine in engine_list:
+        (n_class, _, _, name) = engines[engine]
+        wfile = registry.wfile(engine)
+        if wfile is None:
+            print('[DEBUG] network weights not found for {}'.format(name))
+            continue
+        
+        model = cnn(config.i_shape, n_class)
+        model.load_weights(wfile)
+        stat = os.stat(wfile)
+        
+        entries = []
+        for (tensor_name, weight) in zip(model.names, model.get_weights()):
+            [data, scales] = encode(weight, dtype)
+            entries.append({'name': tensor_name,
+                            'dtype': str(data.dtype),
+                            'shape': list(data.shape),
+                            'offset': offset,
+                            'scales': None if scales is None
+                                      else scales.tolist()})
+            tensors.append((offset, data))
+            offset = align(offset + data.nbytes)
+        
+        header['engines'][engine] = {'n_class': n_class,
+                                     'dtype': dtype,
+                                     'source': os.path.basename(wfile),
+                                     'source_size': stat.st_size,
+                                     'source_mtime': int(stat.st_mtime),
+                                     'tensors': entries}
+    
+    # tensor offsets are relative to the aligned end of the header
+    text = json.dumps(header, sort_keys=True).encode('utf-8')
+    start = align(len(magic) + 8 + len(text))
+    
+    tfile = path + '.tmp'
+    with open(tfile, 'wb') as file:
+        file.write(magic)
+        file.write(struct.pack('<Q', len(text)))
+        file.write(text)
+        for (tensor_offset, data) in tensors:
+            file.write(b'\0' * (start + tensor_offset - file.tell()))
+            file.write(data.tobytes())
+    os.rename(tfile, path)
+    
+    return header
+
+
+################################################################################
+
+# map a bundle read-only returning its header and data (once per process
+# unless the file is replaced)
+def load(path):
+    mtime = os.path.getmtime(path)
+    
+    with lock:
+        if path in mapped and mapped[path][0] == mtime:
+            return mapped[path][1:]
+        
+        with open(path, 'rb') as file:
+            if file.read(len(magic)) != magic:
+                raise ValueError('{} is not a weight bundle'.format(path))
+            (length,) = struct.unpack('<Q', file.read(8))
+            header = json.loads(file.read(length).decode('utf-8'))
+        
+        start = align(len(magic) + 8 + length)
+        data = numpy.memmap(path, dtype='uint8', mode='r')
+        mapped[path] = (mtime, header, data[start:])
+        
+        return mapped[path][1:]
+
+
+# weights of an engine from a bundle as views of the mapped file
+def weights(path, engine):
+    (header, data) = load(path)
+    if engine not in header['engines']:
+        return None
+    
+    result = []
+    for entry in header['engines'][engine]['tensors']:
+        dtype = numpy.dtype(str(entry['dtype']))
+        size = int(numpy.prod(entry['shape'])) * dtype.itemsize
+        view = data[entry['offset']:entry['offset']+size]
+        view = view.view(dtype).reshape(entry['shape'])
+        result.append(decode(view, entry))
+    
+    return result
+
+
+# whether a bundled engine was exported from the given weights file
+def current(path, engine, wfile):
+    (header, _) = load(path)
+    entry = header['engines'].get(engine)
+    if entry is None or wfile is None:
+        return False
+    
+    stat = os.stat(wfile)
+    
+    return entry['source'] == os.path.basename(wfile) and \
+        entry['source_size'] == stat.st_size and \
+        entry['source_mtime'] == int(stat.st_mtime)
+
+
+# storage type of a bundled engine
+def storage(path, engine):
+    (header, _) = load(path)
+    
+    return header['engines'][engine]['dtype']
+
+
+################################################################################
+
+# compare predictions from a bundle with predictions from the source weights
+def verify(path, engine_list, n_samples=256, seed=0):
+    import cv2
+    
+    registry = ModelRegistry()
+    random = numpy.random.RandomState(seed)
+    (c, h, w) = config.i_shape
+    
+    # random blobs thresholded into binary glyph-like inputs
+    x = random.rand(n_samples, h, w).astype('float32')
+    x = numpy.stack([cv2.GaussianBlur(image, (0, 0), 4) for image in x])
+    x = (x > numpy.percentile(x, 80, axis=(1, 2), keepdims=True))
+    x = x.astype('float32')[:, None]
+    
+    results = {}
+    for engine in engine_list:
+        n_class = engines[engine][0]
+        
+        t0 = time.time()
+        reference = cnn(config.i_shape, n_class)
+        reference.load_weights(registry.wfile(engine))
+        t_h5 = time.time() - t0
+        
+        t0 = time.time()
+        model = cnn(config.i_shape, n_class)
+        model.set_weights(weights(path, engine))
+        t_bundle = time.time() - t0
+        
+        y_h5 = reference.predict(x, batch_size=n_samples)
+        y_bundle = model.predict(x, batch_size=n_samples)
+        
+        results[engine] = {'max_abs_diff': float(numpy.abs(y_h5 -
+                                                           y_bundle).max()),
+                           'agreement': float(numpy.mean(
+                                   y_h5.argmax(axis=1) ==
+                                   y_bundle.argmax(axis=1))),
+                           'load_h5': t_h5,
+                           'load_bundle': t_bundle}
+    
+    return results
+
+
+################################################################################
+
+# main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='export and verify '
+                                     'memory-mappable weight bundles')
+    parser.add_argument('--output', default=os.path.join(config.mpath,
+                                                         'weights.bundle'),
+                        help='bundle file of all engines')
+    parser.add_argument('--engine', nargs='+', default=list(engines),
+                        choices=engines)
+    parser.add_argument('--dtype', default='float32', choices=dtypes)
+    parser.add_argument('--split', action='store_true',
+                        help='write one bundle per engine next to output')
+    parser.add_argument('--agreement', type=float, default=None,
+                        help='minimum fraction of matching labels (default: '
+                             '1.0 float32, 0.99 float16, 0.95 int8)')
+    args = parser.parse_args()
+    
+    if args.split:
+        (root, extn) = os.path.splitext(args.output)
+        jobs = [('{}_{}{}'.format(root, engine.replace('-', '_'), extn),
+                 [engine]) for engine in args.engine]
+    else:
+        jobs = [(args.output, args.engine)]
+    
+    # quantized weights flip labels of some ambiguous random inputs
+    agreement = args.agreement
+    if agreement is None:
+        agreement = {'float32': 1.0, 'float16': 0.99, 'int8': 0.95}[args.dtype]
+    
+    failed = False
+    for (path, engine_list) in jobs:
+        header = export(path, engine_list, args.dtype)
+        results = verify(path, list(header['engines']))
+        
+        print('[DEBUG] wrote {} ({} bytes)'.format(path,
+                                                    os.path.getsize(path)))
+        for (engine, result) in sorted(results.items()):
+            print('[DEBUG] {:10s} agreement {:.4f} max diff {:.6f} load h5 '
+                  '{:.4f}s bundle {:.4f}s'.format(engine,
+                                                  result['agreement'],
+                                                  result['max_abs_diff'],
+                                                  result['load_h5'],
+                                                  result['load_bundle']))
+            if result['agreement'] < agreement:
+                failed = True
+    
+    if failed:
+        sys.exit('predictions from bundle differ from source weights')
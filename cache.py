@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import division
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+import numpy
+
+import config
+import metrics
+
+
+# setup environment
+# ---- version of the layout of cached results ----
+# bump whenever the result list of ocrlib.ocr_result changes so that entries
+# stored in an older layout are never read back
+result_format = 2
+
+
+################################################################################
+
+# content-addressed cache of recognition results with memory and disk tiers
+class ResultCache(object):
+    def __init__(self, capacity=None, path=None, disk_capacity=None):
+        if capacity is None:
+            capacity = config.cache_size
+        if path is None:
+            path = config.cache_file
+        if disk_capacity is None:
+            disk_capacity = config.cache_disk_size
+        
+        self.capacity = capacity
+        self.path = path
+        self.disk_capacity = disk_capacity
+        self.memory = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pid = None
+        self.puts = 0
+        self.stats = {'hits_memory': 0, 'hits_disk': 0, 'misses': 0,
+                      'evictions_memory': 0, 'evictions_disk': 0}
+    
+    # whether any tier is enabled
+    def enabled(self):
+        return self.capacity > 0 or self.path is not None
+    
+    # key of an encoded image recognized with given settings and weights in
+    # the current result layout
+    def key(self, data, segmentation, engine, version):
+        digest = hashlib.sha1(data)
+        digest.update('\0'.join(['', str(segmentation), str(engine),
+                                 str(version), str(result_format)])
+                      .encode('utf-8'))
+        
+        return digest.hexdigest()
+    
+    # count a cache event
+    def count(self, event, n=1):
+        self.stats[event] += n
+        if config.metrics:
+            metrics.cache_events.inc((('event', event),), n)
+        
+        return
+    
+    # open the disk tier once per process since connections cannot be forked
+    def disk(self):
+        if self.path is None:
+            return None
+        
+        if self.connection is None or self.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            
+            self.connection = sqlite3.connect(self.path, timeout=30,
+                                              check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS results '
+                                    '(key TEXT PRIMARY KEY, engine TEXT, '
+                                    'version TEXT, value TEXT, '
+                                    'accessed REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS accessed '
+                                    'ON results (accessed)')
+            self.connection.commit()
+            self.pid = os.getpid()
+        
+        return self.connection
+    
+    # drop entries of an engine computed with other weights
+    def validate(self, engine, version):
+        if self.versions.get(engine) == version:
+            return
+        
+        stale = [key for (key, (e, v, _)) in self.memory.items()
+                 if e == engine and v != version]
+        for key in stale:
+            del self.memory[key]
+        
+        connection = self.disk()
+        if connection is not None:
+            connection.execute('DELETE FROM results WHERE engine = ? AND '
+                               'version != ?', (engine, version))
+            connection.commit()
+        
+        self.versions[engine] = version
+        
+        return
+    
+    # get a cached result
+    def get(self, key, engine, version):
+        with self.lock:
+            self.validate(engine, version)
+            
+            if key in self.memory:
+                self.memory[key] = self.memory.pop(key)
+                self.count('hits_memory')
+                return self.memory[key][2]
+            
+            connection = self.disk()
+            if connection is not None:
+                row = connection.execute('SELECT value FROM results WHERE '
+                                         'key = ?', (key,)).fetchone()
+                if row is not None:
+                    connection.execute('UPDATE results SET accessed = ? '
+                                       'WHERE key = ?', (time.time(), key))
+                    connection.commit()
+                    value = json.loads(row[0])
+                    self.store(key, engine, version, value)
+                    self.count('hits_disk')
+                    return value
+            
+            self.count('misses')
+        
+        return None
+    
+    # store a result in the memory tier evicting least recently used entries
+    def store(self, key, engine, version, value):
+        if self.capacity <= 0:
+            return
+        
+        self.memory[key] = (engine, version, value)
+        
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+            self.count('evictions_memory')
+        
+        return
+    
+    # put a result into all tiers
+    def put(self, key, engine, version, value):
+        with self.lock:
+            self.store(key, engine, version, value)
+            
+            connection = self.disk()
+            if connection is None:
+                return
+            
+            connection.execute('INSERT OR REPLACE INTO results VALUES '
+                               '(?, ?, ?, ?, ?)',
+                               (key, engine, version, json.dumps(value),
+                                time.time()))
+            
+            # bound the disk tier by removing least recently accessed rows
+            self.puts += 1
+            if self.puts % 100 == 0:
+                (n_rows,) = connection.execute('SELECT COUNT(*) FROM '
+                                               'results').fetchone()
+                if n_rows > self.disk_capacity:
+                    n_evict = n_rows - self.disk_capacity
+                    connection.execute('DELETE FROM results WHERE key IN '
+                                       '(SELECT key FROM results ORDER BY '
+                                       'accessed LIMIT ?)', (n_evict,))
+                    self.count('evictions_disk', n_evict)
+            
+            connection.commit()
+        
+        return
+
+
+################################################################################
+
+# cache of predictions keyed by binarized glyphs in front of any model
+class GlyphCache(object):
+    def __init__(self, loader, capacity=None, version=None, name=None):
+        if capacity is None:
+            capacity = config.glyph_cache_size
+        
+        self.name = name
+        self.loader = loader
+        self.capacity = max(1, capacity)
+        self.version = version
+        self.current = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    
+    # compact hashes of binarized glyphs
+    def keys(self, x):
+        bits = numpy.packbits(x.reshape(x.shape[0], -1) > 0.5, axis=1)
+        
+        return [hashlib.sha1(row).digest() for row in bits]
+    
+    # fraction of glyphs served from the cache
+    def hit_rate(self):
+        with self.lock:
+            (hits, misses) = (self.stats['hits'], self.stats['misses'])
+        
+        total = hits + misses
+        
+        return hits / total if total > 0 else 0.0
+    
+    # predict probabilities running the model only for unseen glyphs
+    def predict(self, x, batch_size=32, verbose=0):
+        n_samples = x.shape[0]
+        if n_samples == 0:
+            return self.loader().predict(x, batch_size=batch_size)
+        
+        keys = self.keys(x)
+        probas = [None] * n_samples
+        
+        # look up cached glyphs dropping entries computed with other weights
+        with self.lock:
+            version = self.version() if self.version is not None else None
+            if version != self.current:
+                self.entries.clear()
+                self.current = version
+            
+            for (i, key) in enumerate(keys):
+                if key in self.entries:
+                    self.entries[key] = self.entries.pop(key)
+                    probas[i] = self.entries[key]
+            
+            # predict each unseen glyph once even if it repeats within the
+            # batch
+            unseen = OrderedDict()
+            for (i, key) in enumerate(keys):
+                if probas[i] is None:
+                    unseen.setdefault(key, []).append(i)
+            
+            self.count('hits', n_samples - len(unseen))
+            self.count('misses', len(unseen))
+        
+        if len(unseen) > 0:
+            index = [indices[0] for indices in unseen.values()]
+            results = self.loader().predict(x[index], batch_size=batch_size)
+            
+            with self.lock:
+                for (key, result) in zip(unseen, results):
+                    for i in unseen[key]:
+                        probas[i] = result
+                    self.entries[key] = result
+                
+                while len(self.entries) > self.capacity:
+                    self.entries.popitem(last=False)
+                    self.count('evictions')
+        
+        return numpy.stack(probas)
+    
+    # count a cache event (called holding the cache lock)
+    def count(self, event, n=1):
+        self.stats[event] += n
+        if config.metrics and n > 0:
+            metrics.glyph_cache_events.inc((('engine', str(self.name)),
+                                            ('event', event)), n)
+        
+        return
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+
+import numpy
+
+import config
+
+from ocrlib import calibrate
+from registry import ModelRegistry
+from registry import engines
+from train import pack
+
+
+# setup environment
+# ---- softmax temperatures searched ----
+temperatures = numpy.exp(numpy.linspace(numpy.log(0.05), numpy.log(20.0), 241))
+
+
+################################################################################
+
+# mean negative log likelihood of labels under calibrated probabilities
+def nll(probas, labels, temperature=1.0):
+    calibrated = calibrate(probas, temperature)
+    picked = calibrated[numpy.arange(labels.shape[0]), labels]
+    
+    return float(-numpy.mean(numpy.log(numpy.maximum(picked, 1e-12))))
+
+
+# expected calibration error of the best label over equal width bins
+def ece(probas, labels, temperature=1.0, n_bins=10):
+    calibrated = calibrate(probas, temperature)
+    confidences = calibrated.max(axis=1)
+    correct = calibrated.argmax(axis=1) == labels
+    bins = numpy.minimum((confidences * n_bins).astype('int'), n_bins - 1)
+    
+    error = 0.0
+    for b in range(n_bins):
+        mask = bins == b
+        if numpy.any(mask):
+            error += mask.mean() * abs(correct[mask].mean() -
+                                       confidences[mask].mean())
+    
+    return float(error)
+
+
+################################################################################
+
+# fit the softmax temperature of an engine on the samples train.py holds out
+# for validation (all samples if none are held out)
+def fit(engine, validation=0.1, batch_size=None):
+    if batch_size is None:
+        batch_size = config.batch_predict
+    
+    (ifile, lfile) = pack(engine)
+    images = numpy.load(ifile, mmap_mode='r')
+    labels = numpy.load(lfile)
+    n_samples = labels.shape[0]
+    if n_samples == 0:
+        return None
+    
+    # same split as train.py so that the temperature is fitted on samples
+    # the weights were not trained on
+    index = numpy.random.RandomState(0).permutation(n_samples)
+    n_valid = int(n_samples * validation)
+    index = numpy.sort(index[:n_valid] if n_valid > 0 else index)
+    
+    x = images[index][:, None].astype('float32') / 255.0
+    y = labels[index]
+    probas = ModelRegistry(capacity=1).get(engine).predict(
+            x, batch_size=batch_size)
+    
+    losses = [nll(probas, y, t) for t in temperatures]
+    temperature = float(temperatures[int(numpy.argmin(losses))])
+    
+    return {'temperature': temperature,
+            'n_samples': int(y.shape[0]),
+            'accuracy': float(numpy.mean(probas.argmax(axis=1) == y)),
+            'nll': [nll(probas, y), min(losses)],
+            'ece': [ece(probas, y), ece(probas, y, temperature)]}
+
+
+################################################################################
+
+# main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='fit softmax temperatures '
+                                     'of the engines of auto recognition on '
+                                     'labeled samples')
+    parser.add_argument('--engine', nargs='+', default=[
+                                e for e in config.auto_engines
+                                if e in engines],
+                        choices=engines)
+    parser.add_argument('--validation', type=float, default=0.1,
+                        help='fraction of samples held out by train.py')
+    args = parser.parse_args()
+    
+    calibration = {}
+    for engine in args.engine:
+        result = fit(engine, args.validation)
+        if result is None:
+            print('[DEBUG] no samples of {}, temperature unchanged'
+                  .format(engine))
+            continue
+        
+        calibration[engine] = round(result['temperature'], 3)
+        print('[DEBUG] {:10s} {} samples accuracy {:.4f} temperature {:.3f} '
+              'nll {:.4f} -> {:.4f} ece {:.4f} -> {:.4f}'
+              .format(engine, result['n_samples'], result['accuracy'],
+                      result['temperature'], result['nll'][0],
+                      result['nll'][1], result['ece'][0], result['ece'][1]))
+    
+    # temperatures to set in config.py
+    print('calibration = {}'.format(calibration))
@@ -19,9 +19,35 @@ debug = True
 _host = None
 _port = None
 
+# ---- server ----
+n_workers = 4        # worker processes forked by server.py
+n_threads = 1        # blas/openmp threads per worker process
+cpu_affinity = True  # pin each worker to its own block of cores
+preload = ['en-numbers', 'en-letters', 'bn-numbers', 'bn-letters',
+           'dv-numbers', 'dv-letters']
+batch_spool = 1048576       # bytes of a batch archive kept in memory
+batch_image_size = 16777216 # maximum bytes of an image within a batch
+band_workers = 4     # threads recognizing bands of a page
+band_window = 8      # bands of a page in flight at a time
+asgi_workers = 4     # threads running recognition behind asgi.py
+asgi_queue = 1024    # requests waiting for those threads before 503
+asgi_body_size = 33554432 # maximum bytes of a request body read by asgi.py
+
+# ---- monitoring ----
+metrics = True       # per-stage latency histograms exposed at /metrics
+
+# ---- cache ----
+cache_size = 1024        # results kept in memory (0 disables memory tier)
+cache_file = None        # sqlite file shared by workers (None disables)
+cache_disk_size = 100000 # results kept on disk
+glyph_cache_size = 0     # predictions of glyphs kept per engine (0 disables)
+
 # ---- data ----
 i_shape = (1, 56, 56)
 b_shape = (1, 40, 40)
+scan_max_side = 4096 # side kept when decoding far larger images reduced
+pyramid_height = 0   # segment images twice as tall downscaled to it (0 off)
+stroke_max_side = 4096 # largest side of an image rasterized from strokes
 n_class_en_numbers = 10
 n_class_en_letters = 47
 n_class_bn_numbers = 10
@@ -30,16 +56,26 @@ n_class_dv_numbers = 10
 n_class_dv_letters = 47
 
 # ---- model ----
+backend = 'keras'    # 'keras' or 'numpy' (inference only, no keras/theano)
 f_layers = 6
 c_layers = 3
 batch_training = 128
 batch_finetune = 128
+batch_predict = 256
+batching = False     # share forward passes across concurrent requests
+batch_wait = 2000    # maximum wait in microseconds to fill a shared batch
+max_models = 6       # maximum number of engines resident in memory
+bundles = []         # weight bundles from bundle.py used by numpy backend
+auto_engines = ['en-numbers', 'en-letters', 'bn-numbers', 'bn-letters',
+                'dv-numbers', 'dv-letters']  # candidates of 'auto' engine
+calibration = {}     # softmax temperatures from calibration.py (default 1)
 epoch_training = 100
 epoch_finetune = 100
 
 # ---- paths ----
 dpath = 'data/'
 mpath = 'models/'
+ppath = os.path.join(dpath, 'packed/')
 
 mfile_en_numbers = os.path.join(mpath, 'en_numbers.h5')
 mfile_en_letters = os.path.join(mpath, 'en_letters.h5')
@@ -62,7 +98,9 @@ db_path_bn_letters = os.path.join(dpath, 'bn_letters/')
 db_path_dv_numbers = os.path.join(dpath, 'dv_numbers/')
 db_path_dv_letters = os.path.join(dpath, 'dv_letters/')
 
-db_saving = False
+db_saving = False    # save recognized samples (bypasses the result cache)
+db_format = 'png'    # 'png' files or 'shard' files of raw uint8 samples
+db_queue = 1024      # samples waiting for the background writer
 db_struct = {db_path_en_numbers: n_class_en_numbers,
              db_path_en_letters: n_class_en_letters,
              db_path_bn_numbers: n_class_bn_numbers,
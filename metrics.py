@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import division
+
+import bisect
+import threading
+import time
+
+import config
+
+
+# setup environment
+# ---- high resolution timer ----
+clock = getattr(time, 'perf_counter', time.time)
+
+# ---- histogram buckets ----
+buckets_seconds = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0]
+buckets_counts = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+buckets_pixels = [64, 128, 256, 512, 1024, 2048, 4096, 8192]
+
+
+################################################################################
+
+# format labels in prometheus text format
+def format_labels(labels):
+    if not labels:
+        return ''
+    
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+                                                    .replace('"', '\\"')
+                                                    .replace('\n', '\\n'))
+                          for (k, v) in labels) + '}'
+
+
+################################################################################
+
+# monotonically increasing counter
+class Counter(object):
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self.lock = threading.Lock()
+    
+    def inc(self, labels=(), value=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+    
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} counter'.format(self.name)]
+        
+        with self.lock:
+            for (labels, value) in sorted(self.values.items()):
+                lines.append('{}{} {}'.format(self.name,
+                                              format_labels(labels), value))
+        
+        return lines
+
+
+# histogram with cumulative buckets
+class Histogram(object):
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = list(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+    
+    def observe(self, value, labels=()):
+        i = bisect.bisect_left(self.buckets, value)
+        
+        with self.lock:
+            if labels not in self.values:
+                self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry = self.values[labels]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+    
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} histogram'.format(self.name)]
+        
+        with self.lock:
+            for (labels, (counts, total, count)) in sorted(self.values.items()):
+                cumulative = 0
+                for (bound, n) in zip(self.buckets + ['+Inf'], counts):
+                    cumulative += n
+                    lines.append('{}_bucket{} {}'.format(
+                            self.name, format_labels(labels + (('le', bound),)),
+                            cumulative))
+                lines.append('{}_sum{} {}'.format(self.name,
+                                                  format_labels(labels), total))
+                lines.append('{}_count{} {}'.format(self.name,
+                                                    format_labels(labels),
+                                                    count))
+        
+        return lines
+
+
+################################################################################
+
+# define metrics
+requests = Counter('ocr_requests_total',
+                   'Recognition requests by engine and segmentation mode.')
+failures = Counter('ocr_request_failures_total',
+                   'Failed recognition requests by engine, segmentation mode '
+                   'and status.')
+stages = Histogram('ocr_stage_seconds',
+                   'Latency of recognition stages in seconds.',
+                   buckets_seconds)
+rois = Histogram('ocr_rois',
+                 'Regions of interest found per request.',
+                 buckets_counts)
+heights = Histogram('ocr_image_height_pixels',
+                    'Height of decoded images in pixels.',
+                    buckets_pixels)
+widths = Histogram('ocr_image_width_pixels',
+                   'Width of decoded images in pixels.',
+                   buckets_pixels)
+cache_events = Counter('ocr_cache_events_total',
+                       'Hits, misses and evictions of the result cache.')
+glyph_cache_events = Counter('ocr_glyph_cache_events_total',
+                             'Hits, misses and evictions of the glyph cache.')
+
+collectors = [requests, failures, stages, rois, heights, widths,
+              cache_events, glyph_cache_events]
+
+
+################################################################################
+
+# labels of the request handled by the current thread
+local = threading.local()
+
+
+# no-op context used when metrics are disabled
+class NullContext(object):
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        return False
+
+
+null_context = NullContext()
+
+
+# context attaching labels to all metrics recorded within it
+class LabelContext(object):
+    def __init__(self, labels):
+        self.labels = labels
+    
+    def __enter__(self):
+        self.previous = getattr(local, 'labels', ())
+        local.labels = self.labels
+        requests.inc(self.labels)
+        
+        return self
+    
+    def __exit__(self, *args):
+        local.labels = self.previous
+        
+        return False
+
+
+# context recording its duration as a stage latency
+class StageTimer(object):
+    def __init__(self, stage):
+        self.stage = stage
+    
+    def __enter__(self):
+        self.t0 = clock()
+        
+        return self
+    
+    def __exit__(self, *args):
+        labels = getattr(local, 'labels', ()) + (('stage', self.stage),)
+        stages.observe(clock() - self.t0, labels)
+        
+        return False
+
+
+################################################################################
+
+# label metrics of a request by engine and segmentation mode
+def request(engine=None, segmentation=None):
+    if not config.metrics:
+        return null_context
+    
+    return LabelContext((('engine', str(engine)),
+                         ('segmentation', str(segmentation))))
+
+
+# count a failed request by engine, segmentation mode and response status
+def failure(status, engine=None, segmentation=None):
+    if not config.metrics:
+        return
+    
+    failures.inc((('engine', str(engine)), ('segmentation', str(segmentation)),
+                  ('status', str(status))))
+    
+    return
+
+
+# time a stage of the current request
+def timer(stage):
+    if not config.metrics:
+        return null_context
+    
+    return StageTimer(stage)
+
+
+# wrap a function to record metrics with the labels of the calling thread
+# when it runs on another thread
+def bind(function):
+    labels = getattr(local, 'labels', ())
+    
+    def bound(*args, **kwargs):
+        previous = getattr(local, 'labels', ())
+        local.labels = labels
+        try:
+            return function(*args, **kwargs)
+        finally:
+            local.labels = previous
+    
+    return bound
+
+
+# record the number of regions of interest and the dimensions of an image
+def observe(n_rois, shape):
+    if not config.metrics:
+        return
+    
+    labels = getattr(local, 'labels', ())
+    rois.observe(n_rois, labels)
+    heights.observe(shape[0], labels)
+    widths.observe(shape[1], labels)
+    
+    return
+
+
+# render all metrics in prometheus text format
+def render():
+    lines = []
+    
+    for collector in collectors:
+        lines.extend(collector.render())
+    
+    return '\n'.join(lines) + '\n'
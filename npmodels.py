@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import division
+
+import h5py
+import numpy
+
+from numpy.lib.stride_tricks import as_strided
+
+
+################################################################################
+
+# define layers
+# ---- 2D convolution (valid padding, unit strides) using im2col and gemm ----
+def conv2d(x, kernel, bias):
+    # input is in (samples, rows, cols, channels) order and kernel is a
+    # cross-correlation kernel in (rows, cols, input channels, filters) order
+    (n, h, w, c) = x.shape
+    (kh, kw, _, f) = kernel.shape
+    oh = h - kh + 1
+    ow = w - kw + 1
+    
+    # unfold all receptive fields without copying and gather them as rows
+    x = numpy.ascontiguousarray(x)
+    (sn, sh, sw, sc) = x.strides
+    cols = as_strided(x, shape=(n, oh, ow, kh, kw, c),
+                      strides=(sn, sh, sw, sh, sw, sc))
+    cols = cols.reshape(n * oh * ow, kh * kw * c)
+    
+    # convolve all receptive fields with all filters in a single product
+    y = numpy.dot(cols, kernel.reshape(kh * kw * c, f))
+    y += bias
+    
+    return y.reshape(n, oh, ow, f)
+
+# ---- 2D max pooling (non-overlapping windows) ----
+def maxpool2d(x, pool_size=(2, 2)):
+    (n, h, w, c) = x.shape
+    (ph, pw) = pool_size
+    oh = h // ph
+    ow = w // pw
+    
+    x = x[:, :oh*ph, :ow*pw, :].reshape(n, oh, ph, ow, pw, c)
+    
+    return x.max(axis=(2, 4))
+
+# ---- fully connected ----
+def dense(x, kernel, bias):
+    y = numpy.dot(x, kernel)
+    y += bias
+    
+    return y
+
+# ---- activations ----
+def relu(x):
+    return numpy.maximum(x, 0, out=x)
+
+def softmax(x):
+    x = x - x.max(axis=1, keepdims=True)
+    numpy.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    
+    return x
+
+
+################################################################################
+
+# define models
+# ---- convolutional neural network architecture (inference only) ----
+class NumpyCNN(object):
+    # names of weights in the order of layers
+    names = ['conv2d_1/kernel', 'conv2d_1/bias',
+             'conv2d_2/kernel', 'conv2d_2/bias',
+             'dense_1/kernel', 'dense_1/bias',
+             'dense_2/kernel', 'dense_2/bias',
+             'dense_3/kernel', 'dense_3/bias']
+    
+    def __init__(self, i_shape, n_class):
+        self.i_shape = tuple(i_shape)
+        self.n_class = n_class
+        
+        # shape of feature maps at the input of flatten layer
+        (c, h, w) = self.i_shape
+        h = ((h - 4) // 2 - 2) // 2
+        w = ((w - 4) // 2 - 2) // 2
+        self.f_shape = (16, h, w)
+        
+        # weights are stored as float32 in channels-last, cross-correlation
+        # layout that can be used by the forward pass without any conversion
+        self.weights = [numpy.zeros((5, 5, c, 32), dtype='float32'),
+                        numpy.zeros(32, dtype='float32'),
+                        numpy.zeros((3, 3, 32, 16), dtype='float32'),
+                        numpy.zeros(16, dtype='float32'),
+                        numpy.zeros((16 * h * w, 128), dtype='float32'),
+                        numpy.zeros(128, dtype='float32'),
+                        numpy.zeros((128, 64), dtype='float32'),
+                        numpy.zeros(64, dtype='float32'),
+                        numpy.zeros((64, n_class), dtype='float32'),
+                        numpy.zeros(n_class, dtype='float32')]
+    
+    # load weights saved by keras for models.cnn
+    def load_weights(self, path):
+        with h5py.File(path, 'r') as file:
+            if 'layer_names' not in file.attrs and 'model_weights' in file:
+                file = file['model_weights']
+            
+            backend = file.attrs.get('backend', b'theano')
+            if isinstance(backend, bytes):
+                backend = backend.decode('utf8')
+            
+            weights = []
+            for layer_name in file.attrs['layer_names']:
+                group = file[layer_name]
+                for weight_name in group.attrs['weight_names']:
+                    weights.append(numpy.asarray(group[weight_name]))
+        
+        if len(weights) != len(self.weights):
+            raise ValueError('expected {} weights but found {} in {}'
+                             .format(len(self.weights), len(weights), path))
+        
+        # theano performs true convolution so its kernels are stored flipped
+        if backend == 'theano':
+            weights[0] = weights[0][::-1, ::-1, :, :]
+            weights[2] = weights[2][::-1, ::-1, :, :]
+        
+        # keras flattens channels-first feature maps so rows of the first
+        # dense kernel are reordered to match channels-last feature maps
+        (c, h, w) = self.f_shape
+        weights[4] = weights[4].reshape(c, h, w, -1).transpose(1, 2, 0, 3)
+        weights[4] = weights[4].reshape(c * h * w, -1)
+        
+        self.set_weights(weights)
+        
+        return
+    
+    def get_weights(self):
+        return list(self.weights)
+    
+    def set_weights(self, weights):
+        for (i, weight) in enumerate(weights):
+            if weight.shape != self.weights[i].shape:
+                raise ValueError('shape mismatch for {}: expected {} but found '
+                                 '{}'.format(self.names[i],
+                                             self.weights[i].shape,
+                                             weight.shape))
+            self.weights[i] = numpy.ascontiguousarray(weight, dtype='float32')
+        
+        return
+    
+    def forward(self, x):
+        (k1, b1, k2, b2, k3, b3, k4, b4, k5, b5) = self.weights
+        
+        # channels-first input to channels-last feature maps
+        x = x.astype('float32', copy=False).transpose(0, 2, 3, 1)
+        
+        x = maxpool2d(relu(conv2d(x, k1, b1)))
+        x = maxpool2d(relu(conv2d(x, k2, b2)))
+        x = x.reshape(x.shape[0], -1)
+        x = relu(dense(x, k3, b3))
+        x = relu(dense(x, k4, b4))
+        x = softmax(dense(x, k5, b5))
+        
+        return x
+    
+    def predict(self, x, batch_size=32, verbose=0):
+        n_samples = x.shape[0]
+        y = numpy.empty((n_samples, self.n_class), dtype='float32')
+        
+        for i in range(0, n_samples, batch_size):
+            y[i:i+batch_size] = self.forward(x[i:i+batch_size])
+        
+        return y
+
+
+# ---- convolutional neural network architecture ----
+def cnn(i_shape, n_class):
+    model = NumpyCNN(i_shape, n_class)
+    
+    return model
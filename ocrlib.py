@@ -15,18 +15,73 @@ from __future__ import print_function
 import cv2
 import numpy
 import os
+import threading
+
+from collections import OrderedDict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import config
 import mapper
+import metrics
+import samples
+
+from scan import imraster
+from scan import imread
+from scan import imscan_bands
+from scan import imscanC_boxes
+from scan import imscanH_boxes
+from scan import imscanS_boxes
+from scan import imsegmentC
+from scan import imsegmentH
+from scan import imsegmentS
+from scan import imsize
+from scan import imstrokes
+from scan import imthreshold_rows
+
+
+# setup environment
+# ---- recognition engines ----
+# engine: (negate images, sample directory, symbols of class labels, script)
+profiles = OrderedDict([
+        ('en-numbers', (False, config.db_path_en_numbers,
+                        [chr(c) for (_, c) in
+                         sorted(mapper.map2ascii_en_numbers.items())],
+                        'latin')),
+        ('en-letters', (False, config.db_path_en_letters,
+                        [chr(c) for (_, c) in
+                         sorted(mapper.map2ascii_en_letters.items())],
+                        'latin')),
+        ('bn-numbers', (True, config.db_path_bn_numbers,
+                        [s for (_, s) in
+                         sorted(mapper.map2unicode_bn_numbers.items())],
+                        'bengali')),
+        ('bn-letters', (True, config.db_path_bn_letters,
+                        [s for (_, s) in
+                         sorted(mapper.map2unicode_bn_letters.items())],
+                        'bengali')),
+        ('dv-numbers', (True, config.db_path_dv_numbers,
+                        [s for (_, s) in
+                         sorted(mapper.map2unicode_dv_numbers.items())],
+                        'devanagari')),
+        ('dv-letters', (False, config.db_path_dv_letters,
+                        [s for (_, s) in
+                         sorted(mapper.map2unicode_dv_letters.items())],
+                        'devanagari'))
+])
+
+# ---- threads running engines of automatic recognition concurrently ----
+executor = {'pool': None, 'pid': None}
+executor_lock = threading.Lock()
 
-from scan import imscanC
-from scan import imscanH
+# ---- threads recognizing bands of pages ----
+band_executor = {'pool': None, 'pid': None}
 
 
 ################################################################################
 
 # resize and pad image
-def resize_and_pad_image(image):
+def resize_and_pad_image(image, out=None):
     # image dimension
     (h, w) = image.shape
     
@@ -36,140 +91,413 @@ def resize_and_pad_image(image):
     box_w = config.b_shape[1]
     box_h = config.b_shape[2]
     
+    # zero filled destination image
+    if out is None:
+        out = numpy.zeros((dst_h, dst_w), dtype='uint8')
+    
     if w >= h:
+        new_w = box_w
         new_h = h * box_w // w
-        
-        image = cv2.resize(image, (box_w, new_h), interpolation=cv2.INTER_AREA)
-        
-        pad_w = (dst_w - box_w) // 2
-        pad_h = (dst_h - new_h) // 2
-        
-        pad_l = numpy.zeros((new_h, pad_w), dtype='uint8')
-        pad_r = numpy.zeros((new_h, pad_w), dtype='uint8')
-        pad_t = numpy.zeros((pad_h, dst_w), dtype='uint8')
-        pad_b = numpy.zeros((dst_h-new_h-pad_h, dst_w), dtype='uint8')
-        
-        image = numpy.hstack((pad_l, image, pad_r))
-        image = numpy.vstack((pad_t, image, pad_b))
     else:
         new_w = w * box_h // h
-        
-        image = cv2.resize(image, (new_w, box_h), interpolation=cv2.INTER_AREA)
-        
-        pad_w = (dst_w - new_w) // 2
-        pad_h = (dst_h - box_h) // 2
-        
-        pad_l = numpy.zeros((box_h, pad_w), dtype='uint8')
-        pad_r = numpy.zeros((box_h, dst_w-new_w-pad_w), dtype='uint8')
-        pad_t = numpy.zeros((pad_h, dst_w), dtype='uint8')
-        pad_b = numpy.zeros((pad_h, dst_w), dtype='uint8')
-        
-        image = numpy.hstack((pad_l, image, pad_r))
-        image = numpy.vstack((pad_t, image, pad_b))
+        new_h = box_h
+    
+    pad_w = (dst_w - new_w) // 2
+    pad_h = (dst_h - new_h) // 2
+    
+    # resize image straight into the center of destination image
+    roi = out[pad_h:pad_h+new_h, pad_w:pad_w+new_w]
+    image = cv2.resize(image, (new_w, new_h), dst=roi,
+                       interpolation=cv2.INTER_AREA)
+    
+    # copy if opencv could not write into the destination image directly
+    if image is not roi:
+        roi[...] = image
     
-    return image
+    return out
 
 
 ################################################################################
 
-# optical character recognition
-def ocr(model, file, segmentation=None, engine=None, debug=False):
+# normalize images into a batch of features
+def normalize(images, negate=False):
     # read configurations
     dst_w = config.i_shape[1]
     dst_h = config.i_shape[2]
     
-    if engine == 'en-numbers':
-        th_flag = False
-        db_path = config.db_path_en_numbers
-    elif engine == 'en-letters':
-        th_flag = False
-        db_path = config.db_path_en_letters
-    elif engine == 'bn-numbers':
-        th_flag = True
-        db_path = config.db_path_bn_numbers
-    elif engine == 'bn-letters':
-        th_flag = True
-        db_path = config.db_path_bn_letters
-    elif engine == 'dv-numbers':
-        th_flag = True
-        db_path = config.db_path_dv_numbers
-    elif engine == 'dv-letters':
-        th_flag = False
-        db_path = config.db_path_dv_letters
+    # resize and pad each image into a slot of a preallocated batch
+    n_images = len(images)
+    images_uint8 = numpy.zeros((n_images, dst_h, dst_w), dtype='uint8')
+    
+    for (i, image) in enumerate(images):
+        resize_and_pad_image(image, out=images_uint8[i])
+    
+    # scale features in place and perform negation to produce binary images
+    # similar to training images
+    features = numpy.empty((n_images, 1, dst_h, dst_w), dtype='float32')
+    numpy.multiply(images_uint8, numpy.float32(1.0 / 255.0),
+                   out=features[:, 0])
+    
+    if negate:
+        numpy.subtract(numpy.float32(1.0), features, out=features)
+    
+    return [features, images_uint8]
+
+
+################################################################################
+
+# predict labels of a batch of images
+def predict(model, images, batch_size=None):
+    # read configurations
+    if batch_size is None:
+        batch_size = config.batch_predict
+    
+    # exit if batch is empty
+    if images.shape[0] == 0:
+        return [numpy.zeros(0, dtype='int'), numpy.zeros(0, dtype='float32')]
+    
+    # forward pass over the whole batch in chunks of at most batch_size images
+    probas = model.predict(images, batch_size=batch_size)
+    
+    # decode labels and probabilities of the whole batch at once
+    preds = numpy.argmax(probas, axis=1)
+    probs = numpy.round(numpy.max(probas, axis=1), 2)
+    
+    return [preds, probs]
+
+
+################################################################################
+
+# thread pool of the current process since threads do not survive forks
+def engine_pool():
+    with executor_lock:
+        if executor['pool'] is None or executor['pid'] != os.getpid():
+            executor['pool'] = ThreadPoolExecutor(max_workers=len(profiles))
+            executor['pid'] = os.getpid()
+        
+        return executor['pool']
+
+
+# thread pool of the current process recognizing bands of pages
+def band_pool():
+    with executor_lock:
+        if band_executor['pool'] is None or \
+           band_executor['pid'] != os.getpid():
+            band_executor['pool'] = ThreadPoolExecutor(
+                    max_workers=config.band_workers)
+            band_executor['pid'] = os.getpid()
+        
+        return band_executor['pool']
+
+
+# predict probabilities of a batch with several engines concurrently on
+# threads as their forward passes release the global interpreter lock
+def predict_engines(models, images, negated=None, batch_size=None):
+    # read configurations
+    if batch_size is None:
+        batch_size = config.batch_predict
+    
+    pool = engine_pool()
+    futures = OrderedDict()
+    
+    for (engine, model) in models.items():
+        features = negated if profiles[engine][0] else images
+        futures[engine] = pool.submit(model.predict, features,
+                                      batch_size=batch_size)
+    
+    return OrderedDict((engine, future.result())
+                       for (engine, future) in futures.items())
+
+
+# calibrate probabilities of an engine by temperature scaling
+def calibrate(probas, temperature=1.0):
+    if temperature == 1.0:
+        return probas
+    
+    logits = numpy.log(numpy.maximum(probas, 1e-12)) / temperature
+    logits -= logits.max(axis=1, keepdims=True)
+    numpy.exp(logits, out=logits)
+    logits /= logits.sum(axis=1, keepdims=True)
+    
+    return logits
+
+
+# best calibrated probability per image rescaled so that chance (one over the
+# number of classes) is 0 and certainty is 1, which makes engines with
+# different numbers of classes comparable
+def confidence(calibrated):
+    chance = 1.0 / calibrated.shape[1]
+    
+    return (numpy.max(calibrated, axis=1) - chance) / (1.0 - chance)
+
+
+# pick the engine and label with the best calibrated confidence per image
+# reporting the calibrated probability of the label
+def select(probas):
+    engines = list(probas.keys())
+    labels = []
+    probabilities = []
+    confidences = []
+    
+    for engine in engines:
+        calibrated = calibrate(probas[engine],
+                               config.calibration.get(engine, 1.0))
+        labels.append(numpy.argmax(calibrated, axis=1))
+        probabilities.append(numpy.max(calibrated, axis=1))
+        confidences.append(confidence(calibrated))
+    
+    labels = numpy.stack(labels)
+    probabilities = numpy.stack(probabilities)
+    confidences = numpy.stack(confidences)
+    best = numpy.argmax(confidences, axis=0)
+    index = numpy.arange(best.shape[0])
+    
+    return [[engines[i] for i in best], labels[best, index],
+            numpy.round(probabilities[best, index], 2)]
+
+
+################################################################################
+
+# candidate engines with the model of each (automatic recognition takes a
+# mapping of engines to models)
+def candidates(model, engine):
+    if engine == 'auto':
+        return OrderedDict((e, model[e]) for e in config.auto_engines
+                           if e in profiles and e in model)
+    elif engine in profiles:
+        return OrderedDict([(engine, model)])
+    
+    return OrderedDict()
+
+
+# recognize regions of interest with candidate engines
+def recognize(models, engine, image_rois, image_bboxes):
+    # resize, pad, negate and scale all regions of interest into a batch
+    # (both polarities once for automatic recognition)
+    with metrics.timer('normalization'):
+        if engine == 'auto':
+            [images, images_uint8] = normalize(image_rois)
+            negated = None
+            if any(profiles[e][0] for e in models):
+                negated = numpy.subtract(numpy.float32(1.0), images)
+        else:
+            [images, images_uint8] = normalize(image_rois,
+                                               negate=profiles[engine][0])
+    
+    # predict labels of all regions of interest in one forward pass per engine
+    with metrics.timer('inference'):
+        if engine == 'auto' and len(image_rois) > 0:
+            [engines, preds, probs] = select(predict_engines(models, images,
+                                                             negated))
+        else:
+            [preds, probs] = predict(models[list(models)[0]], images)
+            engines = [list(models)[0]] * len(preds)
+    
+    # map each prediction to a symbol
+    with metrics.timer('mapping'):
+        prediction = [profiles[e][2][pred] for (e, pred) in zip(engines,
+                                                                preds)]
+        predprobas = [str(prob) for prob in probs]
+    
+    # save images into database
+    if config.db_saving:
+        for (i, (e, pred)) in enumerate(zip(engines, preds)):
+            (th_flag, db_path) = profiles[e][:2]
+            if th_flag:
+                image_dump = 255 - images_uint8[i]
+            else:
+                image_dump = images_uint8[i]
+            
+            # written behind the request by the sample store
+            samples.store.add(db_path, pred, image_dump)
+    
+    # prediction
+    predstring = ''.join(prediction)
+    
+    # bounding boxes (x, y, w, h) of regions of interest in image
+    bboxes = numpy.asarray(image_bboxes, dtype='int').reshape(-1, 4).tolist()
+    
+    return [predstring, prediction, predprobas, bboxes, engines]
+
+
+################################################################################
+
+# optical character recognition returning [predstring, prediction,
+# predprobas, bboxes, engines]
+def ocr_result(model, file, segmentation=None, engine=None, debug=False):
+    models = candidates(model, engine)
+    if not models:
+        return ['', [], [], [], []]
+    
+    # scan image and find regions of interest (drawn only when debugging)
+    if segmentation == 'contour':
+        scans = imscanC_boxes(file, bbox_width=2, annotate=debug,
+                              verbose=debug)
+    elif segmentation == 'histogram':
+        scans = imscanH_boxes(file, boundary_width=2, bbox_width=2,
+                              annotate=debug, verbose=debug)
+    elif segmentation == 'stats':
+        # merge detached strokes of glyphs in bengali and devanagari scripts
+        merge = all(profiles[e][3] != 'latin' for e in models)
+        scans = imscanS_boxes(file, bbox_width=2, merge=merge,
+                              annotate=debug, verbose=debug)
     else:
-        return ['', [], []]
+        return ['', [], [], [], []]
+    
+    if scans is None:
+        raise ValueError('cannot decode image')
+    
+    [image_scan, image_rois, image_bboxes, factor] = scans
+    
+    # record number of regions of interest and dimensions of the full
+    # resolution image (known from its header when decoded reduced)
+    shape = image_scan.shape
+    if factor > 1:
+        shape = imsize(file)
+    metrics.observe(len(image_rois), shape)
     
-    # scan image and find regions of interest
+    result = recognize(models, engine, image_rois, image_bboxes)
+    
+    # save image
+    if debug:
+        cv2.imwrite(os.path.join(config.dpath, 'scan.png'), image_scan)
+    
+    return result
+
+
+# optical character recognition returning [predstring, prediction,
+# predprobas]
+def ocr(model, file, segmentation=None, engine=None, debug=False):
+    return ocr_result(model, file, segmentation, engine, debug)[:3]
+
+
+################################################################################
+
+# segment a thresholded image (a band or rasterized strokes) without drawing
+def segment_th(image_th, segmentation, merge):
     if segmentation == 'contour':
-        [image_scan, image_rois] = imscanC(file, bbox_width=2, verbose=debug)
+        return imsegmentC(image_th)
     elif segmentation == 'histogram':
-        [image_scan, image_rois] = imscanH(file, boundary_width=2, bbox_width=2,
-                                           verbose=debug)
+        return imsegmentH(image_th)
+    
+    return imsegmentS(image_th, merge=merge)
+
+
+# recognize a band of rows of a grayscale page
+def recognize_band(models, engine, image_gray, row_0, row_1, segmentation,
+                   merge):
+    # threshold and segment only the rows of the band
+    with metrics.timer('preprocess'):
+        image_th = imthreshold_rows(image_gray, row_0, row_1)
+    
+    with metrics.timer('segmentation'):
+        [image_rois, image_bboxes] = segment_th(image_th, segmentation,
+                                                merge)
+    
+    # bounding boxes in page coordinates
+    image_bboxes[:, 1] += row_0
+    
+    return recognize(models, engine, image_rois, image_bboxes)
+
+
+# optical character recognition of a page band by band yielding
+# [band, top, bottom, result] in reading order as soon as each band is done
+# (bands are recognized on threads while only a few are in flight)
+def ocr_bands(model, file, segmentation=None, engine=None):
+    models = candidates(model, engine)
+    if not models or segmentation not in ['contour', 'histogram', 'stats']:
+        return
+    
+    # merge detached strokes of glyphs in bengali and devanagari scripts
+    merge = all(profiles[e][3] != 'latin' for e in models)
+    
+    # keep one grayscale copy of the page instead of color, gray, blurred
+    # and thresholded copies (a page decoded to grayscale is used as is)
+    if isinstance(file, numpy.ndarray) and file.ndim == 2:
+        image_gray = file
     else:
-        return ['', [], []]
+        with metrics.timer('image_decode'):
+            image_gray = imread(file, gray=True)
     
-    # process each region of interest
-    prediction = []
-    predprobas = []
+    if image_gray is None:
+        raise ValueError('cannot decode image')
     
-    for image_roi in image_rois:
-        # resize and pad image
-        image_roi = resize_and_pad_image(image_roi)
-        
-        # perform negation to produce a binary image similar to training images
-        if th_flag:
-            image_roi = 255 - image_roi
-        
-        # make a copy of the image to save into database
-        image_dump = image_roi.copy()
-        
-        # reshape and scale features
-        image_roi = image_roi.astype('float64').reshape(1, 1, dst_h, dst_w)
-        image_roi = image_roi / 255.0
-        
-        # predict label
-        prob = model.predict(image_roi)
-        pred = numpy.argmax(prob)
-        prob = numpy.round(numpy.max(prob), 2)
-        
-        if engine == 'en-numbers':
-            symb = str(pred)
-        elif engine == 'en-letters':
-            symb = chr(mapper.map2ascii_en_letters[pred])
-        elif engine == 'bn-numbers':
-            symb = mapper.map2unicode_bn_numbers[pred]
-        elif engine == 'bn-letters':
-            symb = mapper.map2unicode_bn_letters[pred]
-        elif engine == 'dv-numbers':
-            symb = mapper.map2unicode_dv_numbers[pred]
-        elif engine == 'dv-letters':
-            symb = mapper.map2unicode_dv_letters[pred]
-        else:
-            return ['', [], []]
-        
-        # append prediction to list
-        prediction.append(str(symb))
-        predprobas.append(str(prob))
-        
-        # save image into database
-        if config.db_saving:
-            dpath = os.path.join(db_path, str(pred))
-            index = len(os.listdir(dpath))
-            fpath = os.path.join(dpath, ''.join([str(pred), '_',
-                                                 str(index), '.png']))
+    # find line bands from the row histogram
+    with metrics.timer('bands'):
+        y_samples = imscan_bands(image_gray)[1]
+    
+    n_bands = len(y_samples) - 1
+    n_rois = 0
+    
+    pool = band_pool()
+    job = metrics.bind(recognize_band)
+    futures = deque()
+    band = 0
+    
+    try:
+        while band < n_bands or futures:
+            # submit bands up to a window ahead of the band yielded next
+            while band < n_bands and len(futures) < config.band_window:
+                futures.append(pool.submit(job, models, engine, image_gray,
+                                           y_samples[band], y_samples[band+1],
+                                           segmentation, merge))
+                band += 1
             
-            while os.path.isfile(fpath):
-                index += 1
-                fpath = os.path.join(dpath, ''.join([str(pred), '_',
-                                                     str(index), '.png']))
+            k = band - len(futures)
+            result = futures.popleft().result()
+            n_rois += len(result[1])
             
-            cv2.imwrite(fpath, image_dump)
+            yield [k, y_samples[k], y_samples[k+1], result]
+    finally:
+        # drop bands not yet started when the consumer stops early
+        for future in futures:
+            future.cancel()
+    
+    # record number of regions of interest and image dimensions
+    metrics.observe(n_rois, image_gray.shape)
+    
+    return
+
+
+# optical character recognition of strokes (json or binary) rasterized
+# straight into a thresholded image without encoding or decoding an image
+def ocr_strokes(model, data, segmentation=None, engine=None, debug=False):
+    models = candidates(model, engine)
+    if not models or segmentation not in ['contour', 'histogram', 'stats']:
+        return ['', [], [], [], []]
+    
+    # merge detached strokes of glyphs in bengali and devanagari scripts
+    merge = all(profiles[e][3] != 'latin' for e in models)
+    
+    with metrics.timer('preprocess'):
+        [image_th, origin] = imraster(imstrokes(data))
+    
+    with metrics.timer('segmentation'):
+        [image_rois, image_bboxes] = segment_th(image_th, segmentation, merge)
+    
+    # bounding boxes in stroke coordinates
+    image_bboxes[:, :2] += origin
+    
+    # record number of regions of interest and image dimensions
+    metrics.observe(len(image_rois), image_th.shape)
+    
+    result = recognize(models, engine, image_rois, image_bboxes)
     
     # save image
     if debug:
-        cv2.imwrite(os.path.join(config.dpath, 'scan.png'), image_scan)
+        cv2.imwrite(os.path.join(config.dpath, 'strokes.png'), image_th)
     
-    # prediction
-    predstring = ''.join(prediction)
+    return result
+
+
+################################################################################
+
+# characters of a recognition result with probabilities, bounding boxes,
+# engines and scripts
+def characters(result):
+    [_, prediction, predprobas, bboxes, engines] = result
     
-    return [predstring, prediction, predprobas]
+    return [{'symbol': symbol, 'probability': float(proba), 'box': bbox,
+             'engine': engine, 'script': profiles[engine][3]}
+            for (symbol, proba, bbox, engine) in zip(prediction, predprobas,
+                                                     bboxes, engines)]
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import numpy
+
+import config
+
+from registry import ModelRegistry
+from registry import engines
+
+
+# setup environment
+# ---- reference outputs of the keras engines ----
+# inputs.npy holds binary glyph-like inputs, <engine>.npy the probabilities
+# predicted by keras with the theano backend and manifest.json the weights
+# they were predicted with
+rpath = os.path.join(config.mpath, 'reference')
+ifile = os.path.join(rpath, 'inputs.npy')
+manifest_file = os.path.join(rpath, 'manifest.json')
+
+
+################################################################################
+
+# reference outputs file of an engine
+def reference_file(engine):
+    return os.path.join(rpath, engine.replace('-', '_') + '.npy')
+
+
+# digest of a weights file
+def digest(wfile):
+    with open(wfile, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+# random blobs thresholded into binary glyph-like inputs (numpy only so that
+# they can be made next to old keras and theano builds)
+def inputs(n_samples=64, seed=0):
+    random = numpy.random.RandomState(seed)
+    (c, h, w) = config.i_shape
+    
+    # coarse noise smoothed by repeated box filters along rows and columns
+    x = random.rand(n_samples, h // 4, w // 4)
+    x = numpy.kron(x, numpy.ones((4, 4)))
+    for axis in [1, 2, 1, 2]:
+        x = (x + numpy.roll(x, 1, axis) + numpy.roll(x, -1, axis)) / 3.0
+    
+    # blank borders like normalized regions of interest
+    x[:, :6] = 0
+    x[:, -6:] = 0
+    x[:, :, :6] = 0
+    x[:, :, -6:] = 0
+    
+    threshold = numpy.percentile(x.reshape(n_samples, -1), 80, axis=1)
+    x = (x > threshold[:, None, None]).astype('uint8') * 255
+    
+    return x
+
+
+################################################################################
+
+# predict the reference inputs with keras and save the outputs of each engine
+# (requires keras with the theano backend the weights were trained with)
+def save(engine_list):
+    from models import cnn
+    
+    registry = ModelRegistry()
+    
+    if not os.path.isdir(rpath):
+        os.makedirs(rpath)
+    
+    x = inputs()
+    numpy.save(ifile, x)
+    x = x[:, None].astype('float32') / 255.0
+    
+    manifest = {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file, 'r') as file:
+            manifest = json.load(file)
+    
+    for engine in engine_list:
+        (n_class, _, _, name) = engines[engine]
+        wfile = registry.wfile(engine)
+        if wfile is None:
+            print('[DEBUG] network weights not found for {}'.format(name))
+            continue
+        
+        # weights of models.cnn load the same through the sequential model
+        # as through its inner model since layers without weights are
+        # skipped on both sides
+        model = cnn(config.i_shape, n_class)
+        model.model.load_weights(wfile)
+        y = model.predict(x, batch_size=len(x))
+        
+        model = cnn(config.i_shape, n_class)
+        model.load_weights(wfile)
+        if not numpy.array_equal(y, model.predict(x, batch_size=len(x))):
+            sys.exit('load_weights of {} differs from model.load_weights'
+                     .format(engine))
+        
+        numpy.save(reference_file(engine), y.astype('float32'))
+        manifest[engine] = {'source': os.path.basename(wfile),
+                            'sha1': digest(wfile)}
+        
+        print('[DEBUG] saved reference outputs of {} to {}'
+              .format(engine, reference_file(engine)))
+    
+    with open(manifest_file, 'w') as file:
+        json.dump(manifest, file, indent=4, sort_keys=True)
+    
+    return manifest
+
+
+# compare predictions of the numpy backend with the reference outputs
+def check(engine_list, tolerance=1e-4):
+    from npmodels import cnn
+    
+    registry = ModelRegistry()
+    
+    with open(manifest_file, 'r') as file:
+        manifest = json.load(file)
+    
+    x = numpy.load(ifile)[:, None].astype('float32') / 255.0
+    
+    results = {}
+    for engine in engine_list:
+        wfile = registry.wfile(engine)
+        entry = manifest.get(engine)
+        if entry is None or wfile is None or \
+           entry['source'] != os.path.basename(wfile) or \
+           entry['sha1'] != digest(wfile):
+            print('[DEBUG] no reference outputs of the current weights of {}'
+                  .format(engine))
+            continue
+        
+        model = cnn(config.i_shape, engines[engine][0])
+        model.load_weights(wfile)
+        
+        y_reference = numpy.load(reference_file(engine))
+        y = model.predict(x, batch_size=len(x))
+        
+        results[engine] = {'max_abs_diff': float(numpy.abs(y -
+                                                           y_reference).max()),
+                           'agreement': float(numpy.mean(
+                                   y.argmax(axis=1) ==
+                                   y_reference.argmax(axis=1)))}
+        results[engine]['passed'] = \
+            results[engine]['max_abs_diff'] <= tolerance and \
+            results[engine]['agreement'] == 1.0
+    
+    return results
+
+
+################################################################################
+
+# main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='check predictions of the '
+                                     'numpy backend against keras')
+    parser.add_argument('mode', nargs='?', default='check',
+                        choices=['check', 'save'],
+                        help='check the numpy backend (default) or save '
+                             'reference outputs with keras')
+    parser.add_argument('--engine', nargs='+', default=list(engines),
+                        choices=engines)
+    parser.add_argument('--tolerance', type=float, default=1e-4,
+                        help='largest difference of a probability')
+    args = parser.parse_args()
+    
+    if args.mode == 'save':
+        save(args.engine)
+        sys.exit(0)
+    
+    results = check(args.engine, args.tolerance)
+    for (engine, result) in sorted(results.items()):
+        print('[DEBUG] {:10s} agreement {:.4f} max diff {:.2e} {}'
+              .format(engine, result['agreement'], result['max_abs_diff'],
+                      'passed' if result['passed'] else 'FAILED'))
+    
+    if not results or not all(r['passed'] for r in results.values()):
+        sys.exit('predictions of the numpy backend differ from keras')
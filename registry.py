@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import print_function
+
+import os
+import threading
+
+from collections import OrderedDict
+
+import config
+
+
+# setup environment
+# ---- recognition engines ----
+# engine: (number of classes, fine-tuned weights, pre-trained weights, name)
+engines = OrderedDict([
+        ('en-numbers', (config.n_class_en_numbers, config.tfile_en_numbers,
+                        config.mfile_en_numbers, 'english numbers')),
+        ('en-letters', (config.n_class_en_letters, config.tfile_en_letters,
+                        config.mfile_en_letters, 'english letters')),
+        ('bn-numbers', (config.n_class_bn_numbers, config.tfile_bn_numbers,
+                        config.mfile_bn_numbers, 'bengali numbers')),
+        ('bn-letters', (config.n_class_bn_letters, config.tfile_bn_letters,
+                        config.mfile_bn_letters, 'bengali letters')),
+        ('dv-numbers', (config.n_class_dv_numbers, config.tfile_dv_numbers,
+                        config.mfile_dv_numbers, 'devanagari numbers')),
+        ('dv-letters', (config.n_class_dv_letters, config.tfile_dv_letters,
+                        config.mfile_dv_letters, 'devanagari letters'))
+])
+
+
+################################################################################
+
+# build a model for the configured backend
+def build(n_class):
+    if config.backend == 'numpy':
+        from npmodels import cnn
+    else:
+        from models import cnn
+    
+    return cnn(config.i_shape, n_class)
+
+
+################################################################################
+
+# lazy model registry with least recently used eviction
+class ModelRegistry(object):
+    def __init__(self, capacity=None):
+        if capacity is None:
+            capacity = config.max_models
+        
+        self.capacity = max(1, capacity)
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+        self.loading = {}
+    
+    # weights file of an engine preferring fine-tuned weights
+    def wfile(self, engine):
+        (_, tfile, mfile, _) = engines[engine]
+        
+        if os.path.isfile(tfile):
+            return tfile
+        elif os.path.isfile(mfile):
+            return mfile
+        
+        return None
+    
+    # version of the weights of an engine that changes when weights change
+    def version(self, engine):
+        wfile = self.wfile(engine)
+        
+        if wfile is None:
+            return '{}:none'.format(config.backend)
+        
+        stat = os.stat(wfile)
+        version = '{}:{}:{}:{}'.format(config.backend, os.path.basename(wfile),
+                                       stat.st_size, int(stat.st_mtime))
+        
+        # quantized bundles predict slightly differently from their source
+        path = self.bundle(engine)
+        if path is not None:
+            import bundle
+            version += ':' + bundle.storage(path, engine)
+        
+        return version
+    
+    # weight bundle exported from the current weights of an engine
+    def bundle(self, engine):
+        if config.backend != 'numpy' or not config.bundles:
+            return None
+        
+        import bundle
+        wfile = self.wfile(engine)
+        
+        for path in config.bundles:
+            if os.path.isfile(path) and bundle.current(path, engine, wfile):
+                return path
+        
+        return None
+    
+    # build a model and load its weights
+    def load(self, engine):
+        (n_class, _, _, name) = engines[engine]
+        
+        model = build(n_class)
+        wfile = self.wfile(engine)
+        path = self.bundle(engine)
+        
+        if path is not None:
+            # map weights read-only so that processes share their pages
+            import bundle
+            model.set_weights(bundle.weights(path, engine))
+        elif wfile is not None:
+            # keras loads the same weights through the sequential model as
+            # through its inner model since layers without weights are
+            # skipped, so one call serves both backends
+            model.load_weights(wfile)
+        else:
+            print('[DEBUG] network weights not found for {}'.format(name))
+        
+        return model
+    
+    # get the model of an engine loading it on first use and reloading it
+    # when its weights change so that results match the version of the
+    # weights on disk
+    def get(self, engine):
+        if engine not in engines:
+            return None
+        
+        version = self.version(engine)
+        
+        with self.lock:
+            entry = self.models.get(engine)
+            if entry is not None and entry[1] == version:
+                self.insert(engine, entry)
+                return entry[0]
+            loading = self.loading.setdefault(engine, threading.Lock())
+        
+        # load outside the registry lock so that requests for resident
+        # engines never wait on a load while concurrent requests for the
+        # same engine wait for a single load
+        with loading:
+            with self.lock:
+                entry = self.models.get(engine)
+            
+            if entry is None or entry[1] != version:
+                entry = (self.load(engine), version)
+            
+            with self.lock:
+                self.insert(engine, entry)
+        
+        return entry[0]
+    
+    # mark a model as most recently used and evict least recently used models
+    # (called holding the registry lock)
+    def insert(self, engine, entry):
+        self.models.pop(engine, None)
+        self.models[engine] = entry
+        
+        while len(self.models) > self.capacity:
+            self.models.popitem(last=False)
+        
+        return
+    
+    # remove an engine from the registry
+    def evict(self, engine):
+        with self.lock:
+            self.models.pop(engine, None)
+        
+        return
+    
+    # engines currently resident in memory from least to most recently used
+    def loaded(self):
+        with self.lock:
+            return list(self.models.keys())
+    
+    # memory used by weights of resident engines in bytes
+    def memory(self):
+        with self.lock:
+            models = list(self.models.items())
+        
+        return OrderedDict((engine, sum(w.nbytes for w in model.get_weights()))
+                           for (engine, (model, _)) in models)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import print_function
+
+import atexit
+import hashlib
+import io
+import os
+import re
+import threading
+
+import cv2
+import numpy
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from queue import Empty
+    from queue import Queue
+except ImportError:
+    from Queue import Empty
+    from Queue import Queue
+
+import config
+
+
+# setup environment
+# ---- files of a label directory ----
+index_file = 'index.txt'
+shard_file = 'shard.bin'
+
+# ---- samples written per drain of the queue ----
+drain_size = 256
+
+
+################################################################################
+
+# read samples of a label directory in either format as uint8 images
+def load(path, shape=None):
+    if shape is None:
+        shape = config.i_shape[1:]
+    
+    images = []
+    
+    # packed samples
+    shard = os.path.join(path, shard_file)
+    if os.path.isfile(shard):
+        size = shape[0] * shape[1]
+        data = numpy.fromfile(shard, dtype='uint8')
+        data = data[:data.size // size * size]
+        images.extend(data.reshape((-1,) + tuple(shape)))
+    
+    # individual image files
+    for name in sorted(os.listdir(path)):
+        if name.endswith('.png'):
+            image = cv2.imread(os.path.join(path, name), 0)
+            if image is not None:
+                images.append(image)
+    
+    return images
+
+
+################################################################################
+
+# store of recognized samples written behind requests by a background thread
+class SampleStore(object):
+    def __init__(self, format=None, queue_size=None):
+        if format is None:
+            format = config.db_format
+        if queue_size is None:
+            queue_size = config.db_queue
+        
+        if format not in ['png', 'shard']:
+            raise ValueError('unknown sample format {}'.format(format))
+        
+        self.format = format
+        self.queue = Queue(max(1, queue_size))
+        self.labels = {}
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.stats = {'written': 0, 'duplicates': 0, 'errors': 0}
+    
+    # queue a sample of a label blocking only while the queue is full
+    def add(self, db_path, label, image):
+        self.start()
+        self.queue.put((os.path.join(db_path, str(label)), str(label),
+                        numpy.ascontiguousarray(image, dtype='uint8')))
+        
+        return
+    
+    # wait until all queued samples are written
+    def flush(self):
+        if self.thread is not None and self.pid == os.getpid():
+            self.queue.join()
+        
+        return
+    
+    # start the writer once per process since threads do not survive forks
+    def start(self):
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.labels = {}
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+        
+        return
+    
+    # write queued samples in drains grouped by label directory
+    def run(self):
+        while True:
+            items = [self.queue.get()]
+            while len(items) < drain_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            
+            groups = {}
+            for (path, label, image) in items:
+                groups.setdefault((path, label), []).append(image)
+            
+            for ((path, label), images) in groups.items():
+                try:
+                    self.write(path, label, images)
+                except Exception as e:
+                    self.stats['errors'] += len(images)
+                    print('[DEBUG] failed to save samples to {}: {}'
+                          .format(path, e))
+            
+            for _ in items:
+                self.queue.task_done()
+    
+    # state of a label directory kept across writes
+    def label(self, path):
+        if path in self.labels:
+            return self.labels[path]
+        
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        
+        # continue numbering after existing image files
+        count = 0
+        if self.format == 'png':
+            for name in os.listdir(path):
+                match = re.match(r'^.+_(\d+)\.png$', name)
+                if match:
+                    count = max(count, int(match.group(1)) + 1)
+        
+        self.labels[path] = {'seen': set(), 'offset': 0, 'count': count}
+        
+        return self.labels[path]
+    
+    # add digests appended to the index since it was last read, including
+    # those written by other worker processes sharing the directory
+    def tail(self, path, state):
+        index = os.path.join(path, index_file)
+        if not os.path.isfile(index):
+            return
+        
+        with io.open(index, 'rb') as file:
+            file.seek(state['offset'])
+            data = file.read()
+        
+        # leave a partly written last line for the next read
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                state['seen'].add(line.split()[0].decode('ascii'))
+        state['offset'] += end
+        
+        return
+    
+    # write new samples of a label holding an exclusive lock on its index so
+    # that worker processes sharing the directory do not interleave
+    def write(self, path, label, images):
+        state = self.label(path)
+        
+        with io.open(os.path.join(path, index_file), 'a') as index:
+            if fcntl is not None:
+                fcntl.flock(index, fcntl.LOCK_EX)
+            
+            shard = None
+            try:
+                # catch up on samples other workers wrote before checking
+                self.tail(path, state)
+                
+                if self.format == 'shard':
+                    shard = io.open(os.path.join(path, shard_file), 'ab')
+                    size = images[0].size
+                    record = shard.seek(0, os.SEEK_END) // size
+                
+                for image in images:
+                    digest = hashlib.sha1(image.tobytes()).hexdigest()
+                    if digest in state['seen']:
+                        self.stats['duplicates'] += 1
+                        continue
+                    
+                    if self.format == 'shard':
+                        shard.write(image.tobytes())
+                        name = str(record)
+                        record += 1
+                    else:
+                        name = '{}_{}.png'.format(label, state['count'])
+                        while os.path.isfile(os.path.join(path, name)):
+                            state['count'] += 1
+                            name = '{}_{}.png'.format(label, state['count'])
+                        cv2.imwrite(os.path.join(path, name), image)
+                        state['count'] += 1
+                    
+                    index.write(u'{} {}\n'.format(digest, name))
+                    state['seen'].add(digest)
+                    self.stats['written'] += 1
+                
+                # the shard is flushed before the index lists its records
+                if shard is not None:
+                    shard.flush()
+                index.flush()
+                self.tail(path, state)
+            finally:
+                if shard is not None:
+                    shard.close()
+                if fcntl is not None:
+                    fcntl.flock(index, fcntl.LOCK_UN)
+        
+        return
+
+
+################################################################################
+
+# shared sample store
+store = SampleStore()
+
+# write pending samples before the interpreter exits
+atexit.register(store.flush)
@@ -13,11 +13,16 @@ from __future__ import division
 from __future__ import print_function
 
 import cv2
+import json
 import numpy
 import os
+import struct
 
 from matplotlib import pyplot
 
+import config
+import metrics
+
 
 # setup environment
 # ---- image formats ----
@@ -27,6 +32,25 @@ extensions = ['.bmp', '.dib', '.jpeg', '.jpg', '.jpe', '.jp2', '.png', '.webp',
 # ---- opencv version ----
 opencv = int(cv2.__version__.split('.')[0])
 
+# ---- reduced grayscale decoding ----
+reductions = [(8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+              (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+              (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)]
+
+# ---- jpeg start of frame markers ----
+jpeg_sof = [0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD,
+            0xCE, 0xCF]
+
+# ---- binary stroke format ----
+# magic, then per stroke uint16 number of points, uint16 line width and
+# int16 (x, y) points, all little-endian
+stroke_magic = b'STRK'
+
+# ---- largest coordinate and line width of json strokes ----
+# the ranges of the binary format so that values never wrap when cast
+stroke_coordinate_max = 32767
+stroke_width_max = 65535
+
 
 ################################################################################
 
@@ -64,15 +88,20 @@ def endpoints(array):
 
 ################################################################################
 
-# read image
-def imread(path, verbose=False):
+# read image (or its grayscale channel only)
+def imread(path, gray=False, verbose=False):
+    # decode in-memory images without touching the filesystem
+    if isinstance(path, numpy.ndarray) or isbuffer(path):
+        return imdecode(path, gray=gray, verbose=verbose)
+    
     image = None
     
     if verbose: print('loading image.................. ', end = '')
     if os.path.isfile(path):
-        extn = os.path.splitext(path)[-1]
+        extn = os.path.splitext(path)[-1].lower()
         if extn in extensions:
-            image = cv2.imread(path)
+            image = cv2.imread(path, cv2.IMREAD_GRAYSCALE if gray
+                               else cv2.IMREAD_COLOR)
             if verbose: print('done')
         else:
             if verbose: print('unsupported format')
@@ -82,6 +111,185 @@ def imread(path, verbose=False):
     return image
 
 
+################################################################################
+
+# check whether an object is an in-memory encoded image buffer
+def isbuffer(data):
+    if isinstance(data, (bytearray, memoryview)):
+        return True
+    
+    # bytes is an alias of str in python 2 where str is treated as a path
+    return isinstance(data, bytes) and not isinstance(data, str)
+
+
+################################################################################
+
+# decode image (or its grayscale channel only) from an in-memory buffer or
+# array
+def imdecode(data, gray=False, verbose=False):
+    image = None
+    
+    if verbose: print('decoding image................. ', end = '')
+    if isinstance(data, numpy.ndarray) and data.ndim == 3:
+        image = cv2.cvtColor(data, cv2.COLOR_BGR2GRAY) if gray else data.copy()
+    elif isinstance(data, numpy.ndarray) and data.ndim == 2:
+        image = data.copy() if gray else cv2.cvtColor(data,
+                                                      cv2.COLOR_GRAY2BGR)
+    else:
+        if not isinstance(data, numpy.ndarray):
+            data = numpy.frombuffer(data, dtype='uint8')
+        if data.size > 0:
+            image = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE if gray
+                                 else cv2.IMREAD_COLOR)
+    if verbose: print('done' if image is not None else 'unsupported format')
+    
+    return image
+
+
+################################################################################
+
+# dimensions (height, width) of an encoded png or jpeg image from its header
+# or None for other formats
+def imsize(data):
+    if not isbuffer(data):
+        if not os.path.isfile(data):
+            return None
+        with open(data, 'rb') as file:
+            data = file.read(65536)
+    
+    header = bytearray(data[:65536])
+    
+    if header[:8] == b'\x89PNG\r\n\x1a\n' and len(header) >= 24:
+        (w, h) = struct.unpack('>II', bytes(header[16:24]))
+        return (h, w)
+    
+    if header[:2] != b'\xff\xd8':
+        return None
+    
+    # walk jpeg segments up to the frame header
+    i = 2
+    while i + 9 <= len(header) and header[i] == 0xFF:
+        marker = header[i+1]
+        if marker in jpeg_sof:
+            (h, w) = struct.unpack('>HH', bytes(header[i+5:i+9]))
+            return (h, w)
+        (length,) = struct.unpack('>H', bytes(header[i+2:i+4]))
+        i += 2 + length
+    
+    return None
+
+
+# read grayscale image decoding images far larger than needed at a reduced
+# resolution returning [image, reduction factor]
+def imread_reduced(path, max_side=None, verbose=False):
+    if max_side is None:
+        max_side = config.scan_max_side
+    
+    size = None
+    if max_side > 0 and not isinstance(path, numpy.ndarray):
+        size = imsize(path)
+    
+    for (factor, flag) in reductions:
+        if size is None or max(size) // factor < max_side:
+            continue
+        
+        if verbose: print('decoding image reduced by {}... '.format(factor),
+                          end = '')
+        if isbuffer(path):
+            image = cv2.imdecode(numpy.frombuffer(path, dtype='uint8'), flag)
+        else:
+            image = cv2.imread(path, flag)
+        if verbose: print('done' if image is not None else 'failed')
+        
+        return [image, factor]
+    
+    return [imread(path, gray=True, verbose=verbose), 1]
+
+
+################################################################################
+
+# decode strokes posted as json ({"strokes": [{"points": [[x, y], ...],
+# "width": w}, ...]} or a bare list of strokes with points also allowed flat)
+# or in the binary stroke format into a list of [points, width]
+def imstrokes(data):
+    strokes = []
+    
+    if bytes(data[:len(stroke_magic)]) == stroke_magic:
+        data = bytes(data)
+        i = len(stroke_magic)
+        while i < len(data):
+            if i + 4 > len(data):
+                raise ValueError('truncated strokes')
+            (n, width) = struct.unpack('<HH', data[i:i+4])
+            i += 4
+            if i + 4 * n > len(data):
+                raise ValueError('truncated strokes')
+            points = numpy.frombuffer(data, dtype='<i2', count=2*n, offset=i)
+            strokes.append([points.reshape(-1, 2).astype('int32'), width])
+            i += 4 * n
+        
+        return strokes
+    
+    if not isinstance(data, str):
+        data = bytes(data).decode('utf-8')
+    
+    items = json.loads(data)
+    
+    try:
+        if isinstance(items, dict):
+            items = items['strokes']
+        
+        for item in items:
+            points = numpy.asarray(item['points'], dtype='float64')
+            points = numpy.round(points.reshape(-1, 2))
+            width = round(float(item.get('width', 4)))
+            
+            # reject non-finite and out of range values (nan compares false)
+            if not numpy.all(numpy.abs(points) <= stroke_coordinate_max) or \
+               not 0 <= width <= stroke_width_max:
+                raise ValueError('out of range')
+            
+            strokes.append([points.astype('int32'), int(width)])
+    except (KeyError, TypeError, AttributeError, ValueError, OverflowError):
+        raise ValueError('malformed strokes')
+    
+    return strokes
+
+
+# rasterize strokes straight into a thresholded image (ink 255) sized to the
+# ink extent returning the image and its origin (x, y) in stroke coordinates
+def imraster(strokes, max_side=None):
+    if max_side is None:
+        max_side = config.stroke_max_side
+    
+    strokes = [(points, max(1, width)) for (points, width) in strokes
+               if len(points) > 0]
+    if not strokes:
+        return [numpy.zeros((1, 1), dtype='uint8'), (0, 0)]
+    
+    # extent of all points padded by half the widest line
+    points = numpy.concatenate([points for (points, _) in strokes])
+    pad = max(width for (_, width) in strokes) // 2 + 1
+    (x0, y0) = points.min(axis=0) - pad
+    (x1, y1) = points.max(axis=0) + pad + 1
+    
+    if max(x1 - x0, y1 - y0) > max_side:
+        raise ValueError('strokes exceed {} pixels'.format(max_side))
+    
+    image_th = numpy.zeros((y1 - y0, x1 - x0), dtype='uint8')
+    
+    for (points, width) in strokes:
+        points = points - (x0, y0)
+        if len(points) == 1:
+            cv2.circle(image_th, tuple(int(v) for v in points[0]),
+                       max(1, width // 2), 255, -1)
+        else:
+            cv2.polylines(image_th, [points.reshape(-1, 1, 2)], False, 255,
+                          thickness=width)
+    
+    return [image_th, (int(x0), int(y0))]
+
+
 ################################################################################
 
 # preprocess image
@@ -105,80 +313,182 @@ def impreprocess(image, blur_kernel_size=(3, 3), thresh=100, verbose=False):
     return [image, image_gray, image_blur, image_th]
 
 
+# threshold a box (x0, y0, x1, y1) of a grayscale image blurring a margin
+# around it so that the result matches thresholding the whole image
+def imthreshold_box(image_gray, box, blur_kernel_size=(3, 3), thresh=100):
+    (x0, y0, x1, y1) = box
+    margin_x = blur_kernel_size[0] // 2
+    margin_y = blur_kernel_size[1] // 2
+    left = max(0, x0 - margin_x)
+    top = max(0, y0 - margin_y)
+    right = min(image_gray.shape[1], x1 + margin_x)
+    bottom = min(image_gray.shape[0], y1 + margin_y)
+    
+    image_blur = cv2.GaussianBlur(image_gray[top:bottom, left:right],
+                                  blur_kernel_size, 0, 0)
+    (_, image_th) = cv2.threshold(image_blur[y0-top:y1-top, x0-left:x1-left],
+                                  thresh, 255, cv2.THRESH_BINARY_INV)
+    
+    return image_th
+
+
+# threshold rows of a grayscale image blurring a margin of neighbouring rows
+# so that the result matches thresholding the whole image
+def imthreshold_rows(image_gray, row_0, row_1, blur_kernel_size=(3, 3),
+                     thresh=100):
+    return imthreshold_box(image_gray, (0, row_0, image_gray.shape[1], row_1),
+                           blur_kernel_size, thresh)
+
+
+# threshold only the region of a grayscale image around its dark pixels
+# returning the thresholded region and its origin (x, y) in the image
+def imthreshold_ink(image_gray, blur_kernel_size=(3, 3), thresh=100):
+    # rows and columns holding dark pixels from their minima
+    rows = numpy.flatnonzero(image_gray.min(axis=1) <= thresh)
+    cols = numpy.flatnonzero(image_gray.min(axis=0) <= thresh)
+    
+    # blurring can only darken pixels next to dark pixels, so a margin of
+    # twice the kernel radius keeps the result equal to thresholding the
+    # whole image
+    (row_0, row_1) = (0, image_gray.shape[0])
+    (col_0, col_1) = (0, image_gray.shape[1])
+    
+    if len(rows) > 0:
+        margin = 2 * (max(blur_kernel_size) // 2)
+        row_0 = max(row_0, int(rows[0]) - margin)
+        row_1 = min(row_1, int(rows[-1]) + 1 + margin)
+        col_0 = max(col_0, int(cols[0]) - margin)
+        col_1 = min(col_1, int(cols[-1]) + 1 + margin)
+    
+    image_blur = cv2.GaussianBlur(image_gray[row_0:row_1, col_0:col_1],
+                                  blur_kernel_size, 0, 0)
+    (_, image_th) = cv2.threshold(image_blur, thresh, 255,
+                                  cv2.THRESH_BINARY_INV)
+    
+    return [image_th, (col_0, row_0)]
+
+
 ################################################################################
 
-# scan image along rows
-def imscan_rows(image, line_space_threshold=16, verbose=False):
-    # image height
-    im_rows = image.shape[0]
+# find segment boundaries from runs of empty bins of an accumulator
+def imscan_runs(accu, space_threshold, starts=None, ends=None):
+    # length of accumulator
+    n_bins = len(accu)
     
-    # initialize and populate accumulator
-    accu_rows = numpy.sum(image, axis=1, dtype='int') // 255
+    # find starts and ends of non-empty runs
+    if starts is None:
+        edges = numpy.diff(numpy.concatenate(([0], accu != 0, [0]))
+                           .astype('int8'))
+        starts = numpy.flatnonzero(edges == 1)
+        ends = numpy.flatnonzero(edges == -1)
     
-    # find line segments along rows
+    # lengths of empty runs before each non-empty run and after the last one
+    gaps = starts - numpy.concatenate(([0], ends[:-1]))
+    tail = n_bins - int(ends[-1]) if len(ends) > 0 else n_bins
+    
+    # split at the middle of empty runs wide enough to separate segments where
+    # narrower empty runs keep accumulating until the next split
     zero_samp = 0
-    y_samples = []
+    samples = []
     
-    for row in range(im_rows):
-        if accu_rows[row] == 0:
-            zero_samp += 1
-        elif zero_samp >= line_space_threshold:
-            y_samples.append(row - zero_samp // 2)
+    for (start, gap) in zip(starts.tolist(), gaps.tolist()):
+        zero_samp += gap
+        if zero_samp >= space_threshold:
+            samples.append(start - zero_samp // 2)
             zero_samp = 0
-        elif len(y_samples) == 0:
-            y_samples.append(0)
+        elif len(samples) == 0:
+            samples.append(0)
             zero_samp = 0
     
-    y_samples.append(im_rows - zero_samp // 2)
+    samples.append(n_bins - (zero_samp + tail) // 2)
+    
+    return samples
+
+
+################################################################################
+
+# scan image along rows
+def imscan_rows(image, line_space_threshold=16, verbose=False):
+    # initialize and populate accumulator
+    accu_rows = cv2.reduce(image, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S)
+    accu_rows = accu_rows.ravel() // 255
+    
+    # find line segments along rows
+    y_samples = imscan_runs(accu_rows, line_space_threshold)
     
     if verbose: print('found samples along y.......... {}'.format(y_samples))
     
     return [accu_rows, y_samples]
 
 
+################################################################################
+
+# find line bands of a grayscale image from its row histogram thresholding a
+# chunk of rows at a time
+def imscan_bands(image_gray, line_space_threshold=16, chunk_rows=256,
+                 verbose=False):
+    n_rows = image_gray.shape[0]
+    accu_rows = numpy.empty(n_rows, dtype='int32')
+    
+    for row_0 in range(0, n_rows, chunk_rows):
+        row_1 = min(n_rows, row_0 + chunk_rows)
+        image_th = imthreshold_rows(image_gray, row_0, row_1)
+        cv2.reduce(image_th, 1, cv2.REDUCE_SUM,
+                   dst=accu_rows[row_0:row_1].reshape(-1, 1),
+                   dtype=cv2.CV_32S)
+    
+    accu_rows //= 255
+    
+    # find line segments along rows
+    y_samples = imscan_runs(accu_rows, line_space_threshold)
+    
+    if verbose: print('found bands along y............ {}'.format(y_samples))
+    
+    return [accu_rows, y_samples]
+
+
 ################################################################################
 
 # scan image along columns
 def imscan_cols(image, y_samples=[], word_space_threshold=8, verbose=False):
-    # image width
-    im_cols = image.shape[1]
-    
     # number of detected lines
     n_lines = len(y_samples) - 1
     
-    # initialize and populate accumulator
-    accu_cols_list = []
+    # exit if no line is detected
+    if n_lines < 1:
+        return [[], []]
+    
+    # initialize and populate accumulators of all lines in a single matrix
+    accu_cols = numpy.empty((n_lines, image.shape[1]), dtype='int32')
     
     for line in range(n_lines):
-        accu_cols = numpy.sum(image[y_samples[line]:y_samples[line+1], :],
-                              axis=0, dtype='int') // 255
-        accu_cols_list.append(accu_cols)
+        cv2.reduce(image[y_samples[line]:y_samples[line+1], :], 0,
+                   cv2.REDUCE_SUM, dst=accu_cols[line:line+1], dtype=cv2.CV_32S)
+    
+    accu_cols //= 255
+    accu_cols_list = list(accu_cols)
+    
+    # find starts and ends of non-empty runs along columns of all lines at once
+    empty = numpy.zeros((n_lines, 1), dtype='int8')
+    edges = numpy.diff(numpy.hstack((empty, accu_cols != 0, empty))
+                       .astype('int8'), axis=1)
+    (lines, starts) = numpy.nonzero(edges == 1)
+    (_, ends) = numpy.nonzero(edges == -1)
+    
+    bounds = numpy.searchsorted(lines, numpy.arange(n_lines + 1))
     
     # find word segments along columns of each line segment
-    line_index = 0
     x_samples_list = []
     
-    for accu_cols in accu_cols_list:
-        zero_samp = 0
-        x_samples = []
-        
-        for col in range(im_cols):
-            if accu_cols[col] == 0:
-                zero_samp += 1
-            elif zero_samp >= word_space_threshold:
-                x_samples.append(col - zero_samp // 2)
-                zero_samp = 0
-            elif len(x_samples) == 0:
-                x_samples.append(0)
-                zero_samp = 0
-        
-        x_samples.append(im_cols - zero_samp // 2)
+    for line in range(n_lines):
+        (i, j) = (bounds[line], bounds[line+1])
+        x_samples = imscan_runs(accu_cols[line], word_space_threshold,
+                                starts[i:j], ends[i:j])
         x_samples_list.append(x_samples)
         
         if verbose:
             print('line {:2d} samples along x........ {}'
-                  .format(line_index, x_samples))
-            line_index += 1
+                  .format(line, x_samples))
     
     return [accu_cols_list, x_samples_list]
 
@@ -207,14 +517,16 @@ def imdraw_boundary(image, y_samples, x_samples_list,
 
 ################################################################################
 
-# draw bounding boxes on image
+# draw bounding boxes on image (returning the boxes (x, y, w, h) as well if
+# requested)
 def imdraw_bbox(image, image_th, y_samples, x_samples_list,
-                color=(0, 255, 0), width=1):
+                color=(0, 255, 0), width=1, boxes=False):
     # number of detected lines
     n_lines = len(y_samples) - 1
     
     # process objects in image
     image_rois = []
+    image_bboxes = []
     
     for line in range(n_lines):
         x_samples = x_samples_list[line]
@@ -240,9 +552,17 @@ def imdraw_bbox(image, image_th, y_samples, x_samples_list,
             offset_x = x_samples[word]
             offset_y = y_samples[line]
             
-            cv2.rectangle(image, (bbox_col_0+offset_x, bbox_row_0+offset_y),
-                          (bbox_col_1+offset_x, bbox_row_1+offset_y),
-                          color, width)
+            image_bboxes.append((bbox_col_0+offset_x, bbox_row_0+offset_y,
+                                 bbox_col_1-bbox_col_0, bbox_row_1-bbox_row_0))
+            
+            if image is not None:
+                cv2.rectangle(image, (bbox_col_0+offset_x,
+                                      bbox_row_0+offset_y),
+                              (bbox_col_1+offset_x, bbox_row_1+offset_y),
+                              color, width)
+    
+    if boxes:
+        return [image_rois, image, image_bboxes]
     
     return [image_rois, image]
 
@@ -274,63 +594,192 @@ def plot_hist(accu_rows, accu_cols_list):
 
 ################################################################################
 
-# scan image by histogram
-def imscanH(path, boundary_color=(0, 255, 0), boundary_width=1,
-            bbox_color=(255, 0, 0), bbox_width=1, plot=False, verbose=False):
+# scan a grayscale copy of an image (reduced if far larger than needed)
+# thresholding only the region around its dark pixels and segmenting it
+# without drawing returning [image, image_rois, image_bboxes, factor] where
+# the image and regions of interest are reduced by the factor and the boxes
+# are in full resolution image coordinates
+def imscan_gray(path, segment, pyramid_height=None, verbose=False):
+    if pyramid_height is None:
+        pyramid_height = config.pyramid_height
+    
     # read image
-    image = imread(path, verbose=verbose)
+    with metrics.timer('image_decode'):
+        [image, factor] = imread_reduced(path, verbose=verbose)
     
     # exit if read fails
     if image is None:
         return
     
+    # segment tall images downscaled to the pyramid height
+    if pyramid_height > 0 and image.shape[0] >= 2 * pyramid_height:
+        return imscan_pyramid(image, factor, segment, pyramid_height)
+    
+    # preprocess image
+    with metrics.timer('preprocess'):
+        [image_th, origin] = imthreshold_ink(image)
+    
+    # segment image
+    with metrics.timer('segmentation'):
+        [image_rois, image_bboxes] = segment(image_th, factor=factor)
+        
+        image_bboxes[:, :2] += origin
+        image_bboxes *= factor
+    
+    return [image, image_rois, image_bboxes, factor]
+
+
+# segment an image downscaled to about a height and threshold each region of
+# interest from the image itself so that normalization gets sharp glyphs
+def imscan_pyramid(image, factor, segment, height, blur_kernel_size=(3, 3)):
+    (h, w) = image.shape
+    k = h // height
+    
     # preprocess image
-    image_th = impreprocess(image, verbose=verbose)[-1]
+    with metrics.timer('preprocess'):
+        # keep the darkest pixel of each k x k block so that thin strokes
+        # survive downscaling and boxes cover whole glyphs (strips of whole
+        # blocks give the same result without a full size copy)
+        kernel = numpy.ones((k, k), dtype='uint8')
+        strip_rows = 64 * k
+        image_small = numpy.empty((len(range(k//2, h, k)),
+                                   len(range(k//2, w, k))), dtype='uint8')
+        
+        for row in range(0, h, strip_rows):
+            image_strip = cv2.erode(image[row:row+strip_rows], kernel)
+            image_small[row//k:(row+strip_rows)//k] = \
+                image_strip[k//2::k, k//2::k]
+        
+        [image_th, origin] = imthreshold_ink(image_small, blur_kernel_size)
+    
+    # segment image with gaps and noise sizes scaled to the downscaled image
+    with metrics.timer('segmentation'):
+        boxes = segment(image_th, factor=factor*k)[1]
+    
+    # map boxes back to the image widened by the blur radius
+    with metrics.timer('pyramid_rois'):
+        margin = max(blur_kernel_size) // 2
+        boxes = boxes.copy()
+        boxes[:, :2] += origin
+        boxes[:, 2:] += boxes[:, :2]
+        boxes *= k
+        boxes[:, :2] -= margin
+        boxes[:, 2:] += margin
+        boxes[:, 0::2] = numpy.clip(boxes[:, 0::2], 0, w)
+        boxes[:, 1::2] = numpy.clip(boxes[:, 1::2], 0, h)
+        
+        # threshold each region of interest at full resolution and tighten
+        # its box to the dark pixels found there
+        image_rois = []
+        image_bboxes = numpy.empty((boxes.shape[0], 4), dtype='int32')
+        
+        for (i, (x0, y0, x1, y1)) in enumerate(boxes.tolist()):
+            image_roi = imthreshold_box(image, (x0, y0, x1, y1))
+            (x, y, bw, bh) = cv2.boundingRect(image_roi)
+            if bw == 0 or bh == 0:
+                (x, y, bw, bh) = (0, 0, x1 - x0, y1 - y0)
+            
+            image_rois.append(image_roi[y:y+bh, x:x+bw])
+            image_bboxes[i] = (x0 + x, y0 + y, bw, bh)
+        
+        image_bboxes *= factor
     
+    return [image, image_rois, image_bboxes, factor]
+
+
+################################################################################
+
+# segment thresholded image by histogram drawing on image if given (gaps
+# are scaled down for images reduced by a factor)
+def imsegmentH(image_th, image=None, boundary_color=(0, 255, 0),
+               boundary_width=1, bbox_color=(255, 0, 0), bbox_width=1,
+               plot=False, factor=1, verbose=False):
     # scan image along rows
-    [accu_rows, y_samples] = imscan_rows(image_th, verbose=verbose)
+    [accu_rows, y_samples] = imscan_rows(image_th, max(1, 16 // factor),
+                                         verbose=verbose)
     
     # scan image along columns
     [accu_cols_list, x_samples_list] = imscan_cols(image_th, y_samples,
+                                                   max(1, 8 // factor),
                                                    verbose=verbose)
     
     # draw boundaries on image
-    image = imdraw_boundary(image, y_samples, x_samples_list,
-                            boundary_color, boundary_width)
+    if image is not None:
+        image = imdraw_boundary(image, y_samples, x_samples_list,
+                                boundary_color, boundary_width)
     
-    [image_rois, image] = imdraw_bbox(image, image_th,
-                                      y_samples, x_samples_list,
-                                      bbox_color, bbox_width)
+    [image_rois, image, image_bboxes] = imdraw_bbox(image, image_th,
+                                                    y_samples, x_samples_list,
+                                                    bbox_color, bbox_width,
+                                                    boxes=True)
     
     # plot histogram
     if plot:
         plot_hist(accu_rows, accu_cols_list)
     
-    return [image, image_rois]
+    image_bboxes = numpy.array(image_bboxes, dtype='int32').reshape(-1, 4)
+    
+    return [image_rois, image_bboxes]
 
 
-################################################################################
-
-# scan image for contours
-def imscanC(path, bbox_color=(0, 255, 0), bbox_width=1, verbose=False):
+# scan image by histogram returning bounding boxes (x, y, w, h) of regions
+# of interest and the factor the image and regions of interest are reduced
+# by as well (see imscan_gray)
+def imscanH_boxes(path, boundary_color=(0, 255, 0), boundary_width=1,
+                  bbox_color=(255, 0, 0), bbox_width=1, plot=False,
+                  annotate=True, verbose=False):
+    # segment without drawing unless an annotated image is requested
+    if not annotate:
+        return imscan_gray(path, imsegmentH, verbose=verbose)
+    
     # read image
-    image = imread(path, verbose=verbose)
+    with metrics.timer('image_decode'):
+        image = imread(path, verbose=verbose)
     
     # exit if read fails
     if image is None:
         return
     
     # preprocess image
-    image_th = impreprocess(image, verbose=verbose)[-1]
+    with metrics.timer('preprocess'):
+        image_th = impreprocess(image, verbose=verbose)[-1]
+    
+    # segment image
+    with metrics.timer('segmentation'):
+        [image_rois, image_bboxes] = imsegmentH(image_th, image,
+                                                boundary_color, boundary_width,
+                                                bbox_color, bbox_width,
+                                                plot=plot, verbose=verbose)
+    
+    return [image, image_rois, image_bboxes, 1]
+
+
+# scan image by histogram
+def imscanH(path, boundary_color=(0, 255, 0), boundary_width=1,
+            bbox_color=(255, 0, 0), bbox_width=1, plot=False, annotate=True,
+            verbose=False):
+    scans = imscanH_boxes(path, boundary_color, boundary_width, bbox_color,
+                          bbox_width, plot, annotate, verbose)
     
+    return None if scans is None else scans[:2]
+
+
+################################################################################
+
+# segment thresholded image into contours drawing on image if given (the
+# noise height is scaled down for images reduced by a factor)
+def imsegmentC(image_th, image=None, bbox_color=(0, 255, 0), bbox_width=1,
+               factor=1):
     # find contours
     if opencv == 3:
-        (_, contours, _) = cv2.findContours(image_th.copy(), cv2.RETR_EXTERNAL,
+        (_, contours, _) = cv2.findContours(image_th.copy(),
+                                            cv2.RETR_EXTERNAL,
                                             cv2.CHAIN_APPROX_NONE)
     else:
-        (contours, _) = cv2.findContours(image_th.copy(), cv2.RETR_EXTERNAL,
+        (contours, _) = cv2.findContours(image_th.copy(),
+                                         cv2.RETR_EXTERNAL,
                                          cv2.CHAIN_APPROX_NONE)
-
+    
     # find bounding rectangle around each contour
     bn_rects = []
     for cntr in contours:
@@ -341,6 +790,7 @@ def imscanC(path, bbox_color=(0, 255, 0), bbox_width=1, verbose=False):
     
     # process each bounding rectangle
     image_rois = []
+    image_bboxes = []
     
     for rect in bn_rects:
         # attributes of bounding rectangle
@@ -350,15 +800,234 @@ def imscanC(path, bbox_color=(0, 255, 0), bbox_width=1, verbose=False):
         h = rect[3]
         
         # ignore tiny objects assuming them as noise
-        if h <= 8:
+        if h <= 8 // factor:
             continue
         
         # draw bounding rectangle on image
-        cv2.rectangle(image, (x, y), (x+w, y+h), bbox_color, bbox_width)
+        if image is not None:
+            cv2.rectangle(image, (x, y), (x+w, y+h), bbox_color, bbox_width)
         
-        # extract region of interest from thresholded image using attributes of
-        # bounding rectangle
+        # extract region of interest from thresholded image using
+        # attributes of bounding rectangle
         image_roi = image_th[y:y+h, x:x+w]
         image_rois.append(image_roi)
+        image_bboxes.append((x, y, w, h))
+    
+    image_bboxes = numpy.array(image_bboxes, dtype='int32').reshape(-1, 4)
+    
+    return [image_rois, image_bboxes]
+
+
+# scan image for contours returning bounding boxes (x, y, w, h) of regions of
+# interest and the factor the image and regions of interest are reduced by as
+# well (see imscan_gray)
+def imscanC_boxes(path, bbox_color=(0, 255, 0), bbox_width=1,
+                  annotate=True, verbose=False):
+    # segment without drawing unless an annotated image is requested
+    if not annotate:
+        return imscan_gray(path, imsegmentC, verbose=verbose)
+    
+    # read image
+    with metrics.timer('image_decode'):
+        image = imread(path, verbose=verbose)
+    
+    # exit if read fails
+    if image is None:
+        return
+    
+    # preprocess image
+    with metrics.timer('preprocess'):
+        image_th = impreprocess(image, verbose=verbose)[-1]
+    
+    # segment image
+    with metrics.timer('segmentation'):
+        [image_rois, image_bboxes] = imsegmentC(image_th, image, bbox_color,
+                                                bbox_width)
+    
+    return [image, image_rois, image_bboxes, 1]
+
+
+# scan image for contours
+def imscanC(path, bbox_color=(0, 255, 0), bbox_width=1, annotate=True,
+            verbose=False):
+    scans = imscanC_boxes(path, bbox_color, bbox_width, annotate, verbose)
+    
+    return None if scans is None else scans[:2]
+
+
+################################################################################
+
+# group boxes (x0, y0, x1, y1) of components that belong together: boxes
+# contained in another box and, if merging, boxes overlapping horizontally
+# within a vertical gap such as detached strokes of a glyph
+def imgroup_boxes(boxes, merge=False, overlap=0.5, gap=4):
+    n_boxes = boxes.shape[0]
+    
+    # sort boxes from top to bottom so that candidates of each box are the
+    # boxes starting before it ends (plus the gap when merging)
+    boxes = boxes[numpy.argsort(boxes[:, 1], kind='mergesort')]
+    (x0, y0, x1, y1) = boxes.T
+    w = x1 - x0
+    
+    reach = y1 + gap if merge else y1
+    ends = numpy.searchsorted(y0, reach, side='right')
+    counts = numpy.maximum(ends - numpy.arange(n_boxes) - 1, 0)
+    
+    # enumerate candidate pairs (i, j) with i < j without a python loop
+    i = numpy.repeat(numpy.arange(n_boxes), counts)
+    offsets = numpy.arange(i.shape[0]) - numpy.repeat(numpy.cumsum(counts) -
+                                                      counts, counts)
+    j = i + 1 + offsets
+    
+    # boxes nested in one another
+    related = ((x0[i] <= x0[j]) & (y0[i] <= y0[j]) & (x1[i] >= x1[j]) &
+               (y1[i] >= y1[j])) | \
+              ((x0[j] <= x0[i]) & (y0[j] <= y0[i]) & (x1[j] >= x1[i]) &
+               (y1[j] >= y1[i]))
+    
+    # fragments overlapping horizontally within a vertical gap
+    if merge:
+        x_overlap = numpy.minimum(x1[i], x1[j]) - numpy.maximum(x0[i], x0[j])
+        related |= x_overlap >= overlap * numpy.minimum(w[i], w[j])
+    
+    i = i[related]
+    j = j[related]
+    
+    # propagate smallest group labels along pairs with pointer jumping
+    groups = numpy.arange(n_boxes)
+    
+    while i.shape[0] > 0:
+        update = groups.copy()
+        numpy.minimum.at(update, i, groups[j])
+        numpy.minimum.at(update, j, groups[i])
+        update = update[update]
+        if numpy.array_equal(update, groups):
+            break
+        groups = update
+    
+    # union of boxes of each group
+    (roots, groups) = numpy.unique(groups, return_inverse=True)
+    merged = numpy.empty((roots.shape[0], 4), dtype=boxes.dtype)
+    merged[:, :2] = numpy.iinfo(boxes.dtype).max
+    merged[:, 2:] = numpy.iinfo(boxes.dtype).min
+    numpy.minimum.at(merged[:, 0], groups, x0)
+    numpy.minimum.at(merged[:, 1], groups, y0)
+    numpy.maximum.at(merged[:, 2], groups, x1)
+    numpy.maximum.at(merged[:, 3], groups, y1)
+    
+    return merged
+
+
+# order boxes (x, y, w, h) in lines from top to bottom and left to right
+# within each line
+def imorder_boxes(bboxes, line_threshold=0.5):
+    if bboxes.shape[0] == 0:
+        return numpy.zeros(0, dtype='int')
+    
+    # a new line starts where centers jump by more than a fraction of the
+    # typical glyph height
+    centers = bboxes[:, 1] + bboxes[:, 3] / 2.0
+    order = numpy.argsort(centers, kind='mergesort')
+    jumps = numpy.diff(centers[order]) > line_threshold * \
+        numpy.median(bboxes[:, 3])
+    lines = numpy.empty(bboxes.shape[0], dtype='int')
+    lines[order] = numpy.concatenate([[0], numpy.cumsum(jumps)])
+    
+    return numpy.lexsort((bboxes[:, 0], lines))
+
+
+################################################################################
+
+# segment thresholded image into connected components using their statistics
+# drawing on image if given (noise sizes are scaled down for images reduced
+# by a factor)
+def imsegmentS(image_th, image=None, bbox_color=(0, 255, 0), bbox_width=1,
+               min_height=9, min_area=4, merge=False, factor=1):
+    min_height = max(1, min_height // factor)
+    min_area = max(1, min_area // (factor * factor))
+    
+    # bounding boxes and areas of all components in one pass (the first
+    # component is the background)
+    # (16-bit labels halve memory traffic unless there are too many)
+    try:
+        (_, _, stats, _) = cv2.connectedComponentsWithStats(
+                image_th, connectivity=8, ltype=cv2.CV_16U)
+    except cv2.error:
+        (_, _, stats, _) = cv2.connectedComponentsWithStats(
+                image_th, connectivity=8, ltype=cv2.CV_32S)
+    stats = stats[1:]
+    
+    # ignore specks assuming them as noise
+    stats = stats[stats[:, cv2.CC_STAT_AREA] >= min_area]
+    
+    boxes = numpy.empty((stats.shape[0], 4), dtype='int32')
+    boxes[:, 0] = stats[:, cv2.CC_STAT_LEFT]
+    boxes[:, 1] = stats[:, cv2.CC_STAT_TOP]
+    boxes[:, 2] = boxes[:, 0] + stats[:, cv2.CC_STAT_WIDTH]
+    boxes[:, 3] = boxes[:, 1] + stats[:, cv2.CC_STAT_HEIGHT]
+    
+    # group nested components and fragments of glyphs
+    if merge:
+        boxes = imgroup_boxes(boxes, merge=True)
+    
+    bboxes = boxes
+    bboxes[:, 2:] -= boxes[:, :2]
+    
+    # ignore short objects assuming them as noise
+    bboxes = bboxes[bboxes[:, 3] >= min_height]
+    
+    # sort bounding boxes in reading order
+    bboxes = bboxes[imorder_boxes(bboxes)]
+    
+    # draw bounding rectangles and extract regions of interest
+    image_rois = []
+    
+    for (x, y, w, h) in bboxes.tolist():
+        if image is not None:
+            cv2.rectangle(image, (x, y), (x+w, y+h), bbox_color, bbox_width)
+        image_rois.append(image_th[y:y+h, x:x+w])
+    
+    return [image_rois, bboxes]
+
+
+# scan image for connected components using their statistics returning
+# bounding boxes (x, y, w, h) of regions of interest and the factor the image
+# and regions of interest are reduced by as well (see imscan_gray)
+def imscanS_boxes(path, bbox_color=(0, 255, 0), bbox_width=1,
+                  min_height=9, min_area=4, merge=False, annotate=True,
+                  verbose=False):
+    # segment without drawing unless an annotated image is requested
+    if not annotate:
+        segment = lambda image_th, factor: imsegmentS(
+                image_th, min_height=min_height, min_area=min_area,
+                merge=merge, factor=factor)
+        return imscan_gray(path, segment, verbose=verbose)
+    
+    # read image
+    with metrics.timer('image_decode'):
+        image = imread(path, verbose=verbose)
+    
+    # exit if read fails
+    if image is None:
+        return
+    
+    # preprocess image
+    with metrics.timer('preprocess'):
+        image_th = impreprocess(image, verbose=verbose)[-1]
+    
+    # segment image
+    with metrics.timer('segmentation'):
+        [image_rois, image_bboxes] = imsegmentS(image_th, image, bbox_color,
+                                                bbox_width, min_height,
+                                                min_area, merge)
+    
+    return [image, image_rois, image_bboxes, 1]
+
+
+# scan image for connected components using their statistics
+def imscanS(path, bbox_color=(0, 255, 0), bbox_width=1, min_height=9,
+            min_area=4, merge=False, annotate=True, verbose=False):
+    scans = imscanS_boxes(path, bbox_color, bbox_width, min_height, min_area,
+                          merge, annotate, verbose)
     
-    return [image, image_rois]
+    return None if scans is None else scans[:2]
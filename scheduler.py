@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import division
+
+import threading
+import time
+
+from concurrent.futures import Future
+
+import numpy
+
+try:
+    from queue import Empty
+    from queue import Queue
+except ImportError:
+    from Queue import Empty
+    from Queue import Queue
+
+import config
+
+from registry import engines
+
+
+# setup environment
+# ---- clock of batching deadlines unaffected by wall clock steps ----
+# (time.monotonic is missing on python 2)
+clock = getattr(time, 'monotonic', time.time)
+
+
+################################################################################
+
+# queue gathering inputs of concurrent requests into shared batches
+class BatchQueue(object):
+    def __init__(self, loader, max_batch=None, max_wait=None):
+        if max_batch is None:
+            max_batch = config.batch_predict
+        if max_wait is None:
+            max_wait = config.batch_wait
+        
+        self.loader = loader
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait / 1000000.0
+        self.queue = Queue()
+        self.batches = 0
+        self.samples = 0
+        
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    # predict probabilities of a batch sharing forward passes with other calls
+    def predict(self, x, batch_size=None, verbose=0):
+        if x.shape[0] == 0:
+            return numpy.zeros((0, 0), dtype='float32')
+        
+        future = Future()
+        self.queue.put((x, future))
+        
+        return future.result()
+    
+    # gather queued inputs until the batch is full or the wait budget is spent
+    def gather(self):
+        items = [self.queue.get()]
+        size = items[0][0].shape[0]
+        deadline = clock() + self.max_wait
+        
+        while size < self.max_batch:
+            timeout = deadline - clock()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Empty:
+                break
+            items.append(item)
+            size += item[0].shape[0]
+        
+        return items
+    
+    # run one forward pass per batch and route slices of results back
+    def run(self):
+        while True:
+            items = self.gather()
+            
+            try:
+                model = self.loader()
+                batch = numpy.concatenate([x for (x, _) in items])
+                probas = model.predict(batch, batch_size=self.max_batch)
+            except Exception as e:
+                for (_, future) in items:
+                    future.set_exception(e)
+                continue
+            
+            self.batches += 1
+            self.samples += batch.shape[0]
+            
+            offset = 0
+            for (x, future) in items:
+                future.set_result(probas[offset:offset+x.shape[0]])
+                offset += x.shape[0]
+
+
+################################################################################
+
+# inference scheduler with one batch queue per recognition engine
+class InferenceScheduler(object):
+    def __init__(self, registry, max_batch=None, max_wait=None):
+        self.registry = registry
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queues = {}
+        self.lock = threading.Lock()
+    
+    # get the batch queue of an engine creating it on first use
+    def get(self, engine):
+        if engine not in engines:
+            return None
+        
+        with self.lock:
+            if engine not in self.queues:
+                loader = lambda: self.registry.get(engine)
+                self.queues[engine] = BatchQueue(loader, self.max_batch,
+                                                 self.max_wait)
+        
+        return self.queues[engine]
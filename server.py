@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import print_function
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import config
+
+
+# setup environment
+# ---- thread pools of numerical libraries ----
+threads_env = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+               'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS']
+
+
+################################################################################
+
+# limit threads of blas and openmp (must be called before importing numpy)
+def limit_threads(n_threads):
+    for name in threads_env:
+        os.environ[name] = str(n_threads)
+    
+    return
+
+
+################################################################################
+
+# pin the calling process to a block of cores
+def pin_cores(worker, n_threads):
+    if not hasattr(os, 'sched_setaffinity'):
+        return None
+    
+    cores = sorted(os.sched_getaffinity(0))
+    first = (worker * n_threads) % len(cores)
+    cores = [cores[(first + i) % len(cores)]
+             for i in range(min(n_threads, len(cores)))]
+    os.sched_setaffinity(0, cores)
+    
+    return cores
+
+
+################################################################################
+
+# run a worker process serving requests from a shared listening socket
+def work(app, sock, worker, n_threads, affinity):
+    from werkzeug.serving import make_server
+    
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    
+    cores = pin_cores(worker, n_threads) if affinity else None
+    print('[DEBUG] worker {} started with pid {} on cores {}'
+          .format(worker, os.getpid(), cores))
+    
+    (host, port) = sock.getsockname()[:2]
+    server = make_server(host, port, app, fd=sock.fileno())
+    server.serve_forever()
+    
+    return
+
+
+################################################################################
+
+# fork a worker process
+def spawn(app, sock, worker, n_threads, affinity):
+    pid = os.fork()
+    
+    if pid == 0:
+        status = 0
+        try:
+            work(app, sock, worker, n_threads, affinity)
+        except BaseException:
+            status = 1
+        finally:
+            os._exit(status)
+    
+    return pid
+
+
+################################################################################
+
+# serve the application with pre-forked worker processes
+def serve(host=None, port=None, n_workers=None, n_threads=None,
+          affinity=None, preload=None):
+    # read configurations
+    host = host or config._host or '127.0.0.1'
+    port = port or config._port or 5000
+    n_workers = n_workers or config.n_workers
+    n_threads = n_threads or config.n_threads
+    affinity = config.cpu_affinity if affinity is None else affinity
+    preload = config.preload if preload is None else preload
+    
+    # limit threads before numerical libraries are loaded by the application
+    limit_threads(n_threads)
+    
+    from app import app
+    from app import registry
+    
+    # load weights once in the parent so that workers share them copy-on-write
+    for engine in preload:
+        registry.get(engine)
+    
+    # keep garbage collector from touching pages shared with workers
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    
+    # open listening socket shared by all workers
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    
+    print('[DEBUG] serving on http://{}:{}/ with {} workers x {} threads'
+          .format(host, port, n_workers, n_threads))
+    
+    # fork workers
+    workers = {}
+    for worker in range(n_workers):
+        workers[spawn(app, sock, worker, n_threads, affinity)] = worker
+    
+    # stop workers on termination
+    state = {'running': True}
+    
+    def stop(signum, frame):
+        state['running'] = False
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+    
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    
+    # replace workers that exit unexpectedly
+    while workers:
+        try:
+            (pid, _) = os.wait()
+        except OSError:
+            break
+        
+        worker = workers.pop(pid, None)
+        if worker is not None and state['running']:
+            print('[DEBUG] worker {} with pid {} exited, restarting'
+                  .format(worker, pid))
+            time.sleep(0.1)
+            workers[spawn(app, sock, worker, n_threads, affinity)] = worker
+    
+    sock.close()
+    
+    return
+
+
+################################################################################
+
+# main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pre-forked OCR server')
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='blas/openmp threads per worker')
+    parser.add_argument('--no-affinity', action='store_true',
+                        help='do not pin workers to cores')
+    parser.add_argument('--preload', nargs='*', default=None,
+                        help='engines loaded before forking')
+    args = parser.parse_args()
+    
+    if not hasattr(os, 'fork'):
+        sys.exit('pre-forked serving requires a platform with os.fork')
+    
+    serve(args.host, args.port, args.workers, args.threads,
+          False if args.no_affinity else None, args.preload)
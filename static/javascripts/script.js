@@ -38,15 +38,32 @@ var touch = {
     active: false
 };
 
+// strokes drawn on canvas as polylines
+var strokes = [];
+
 // options object
 var options = {
     activeView: 'embedded-view',
     segmentationMode: 'contour',
     recognitionEngine: 'en-numbers',
-    restEndpoint: 'http://localhost:5000/recognize'
+    restEndpoint: 'http://localhost:5000/recognize',
+    uploadFormat: 'strokes'  // 'strokes' posts polylines, 'binary' image bytes, 'base64' a data url
 };
 
 
+// --------------------------------------------------------------------------------
+// stroke recording
+// --------------------------------------------------------------------------------
+
+function recordStroke(x0, y0, x1, y1) {
+    // append a segment to the current stroke in canvas coordinates
+    var points = strokes[strokes.length - 1].points;
+    if(points.length == 0)
+        points.push(Math.round(x0), Math.round(y0));
+    points.push(Math.round(x1), Math.round(y1));
+}
+
+
 // --------------------------------------------------------------------------------
 // mouse events on canvas
 // --------------------------------------------------------------------------------
@@ -59,6 +76,7 @@ canvas.addEventListener('mouseup', function(event) {
 
 canvas.addEventListener('mousedown', function(event) {
     mouse.active = true;
+    strokes.push({width: 4, points: []});
 }, false);
 
 canvas.addEventListener('mousemove', function(event) {
@@ -84,6 +102,8 @@ canvas.addEventListener('mousemove', function(event) {
     context.lineWidth = 4;
     context.stroke();
 
+    recordStroke(mouse.prevX - offsetX, mouse.prevY - offsetY, event.x - offsetX, event.y - offsetY);
+
     mouse.prevX = event.x;
     mouse.prevY = event.y;
 }, false);
@@ -101,6 +121,7 @@ canvas.addEventListener('touchend', function(event) {
 
 canvas.addEventListener('touchstart', function(event) {
     touch.active = true;
+    strokes.push({width: 4, points: []});
 }, false);
 
 canvas.addEventListener('touchmove', function(event) {
@@ -126,6 +147,9 @@ canvas.addEventListener('touchmove', function(event) {
     context.lineWidth = 4;
     context.stroke();
 
+    recordStroke(touch.prevX - offsetX, touch.prevY - offsetY,
+                 event.touches[0].clientX - offsetX, event.touches[0].clientY - offsetY);
+
     touch.prevX = event.touches[0].clientX;
     touch.prevY = event.touches[0].clientY;
 }, false);
@@ -158,7 +182,8 @@ window.addEventListener('resize', function(event) {
     context.fillStyle = 'rgb(255, 240, 165)';
     context.fillRect(0, 0, canvas.width, canvas.height);
 
-    // reset animation and textarea
+    // reset strokes, animation and textarea
+    strokes = [];
     outputRenderer(hideAnim=true, hideText=true, text='', triggerFloatingViewMode=false);
 }, false);
 
@@ -176,11 +201,80 @@ clear.onclick = function(event) {
     context.fillStyle = 'rgb(255, 240, 165)';
     context.fillRect(0, 0, canvas.width, canvas.height);
 
-    // reset animation and textarea
+    // reset strokes, animation and textarea
+    strokes = [];
     outputRenderer(hideAnim=true, hideText=true, text='', triggerFloatingViewMode=false);
 };
 
 
+// --------------------------------------------------------------------------------
+// binary upload
+// --------------------------------------------------------------------------------
+
+function uploadBinary(blob) {
+    // transmit image bytes as request body with options in the query string
+    $.ajax({
+        type: 'POST',
+        url: options.restEndpoint + '?' + $.param({
+            segmentationMode: options.segmentationMode,
+            recognitionEngine: options.recognitionEngine
+        }),
+        data: blob,
+        processData: false,
+        contentType: blob.type || 'application/octet-stream'
+    }).done(function(response) {
+        // hide animation and show textarea
+        outputRenderer(hideAnim=true, hideText=false, text=response);
+    });
+}
+
+
+// --------------------------------------------------------------------------------
+// stroke upload
+// --------------------------------------------------------------------------------
+
+function uploadStrokes() {
+    // pack strokes into the binary stroke format: 'STRK', then per stroke
+    // uint16 number of points, uint16 line width and int16 (x, y) points
+    var drawn = strokes.filter(function(stroke) { return stroke.points.length > 0; });
+    var size = 4;
+    for(var i = 0; i < drawn.length; i++)
+        size += 4 + drawn[i].points.length * 2;
+
+    var buffer = new ArrayBuffer(size);
+    var view = new DataView(buffer);
+    var offset = 4;
+    for(var i = 0; i < 4; i++)
+        view.setUint8(i, 'STRK'.charCodeAt(i));
+
+    for(var i = 0; i < drawn.length; i++) {
+        var points = drawn[i].points;
+        view.setUint16(offset, points.length / 2, true);
+        view.setUint16(offset + 2, drawn[i].width, true);
+        offset += 4;
+        for(var j = 0; j < points.length; j++) {
+            view.setInt16(offset, points[j], true);
+            offset += 2;
+        }
+    }
+
+    // transmit strokes without rendering or encoding an image
+    $.ajax({
+        type: 'POST',
+        url: options.restEndpoint + '/strokes?' + $.param({
+            segmentationMode: options.segmentationMode,
+            recognitionEngine: options.recognitionEngine
+        }),
+        data: buffer,
+        processData: false,
+        contentType: 'application/octet-stream'
+    }).done(function(response) {
+        // hide animation and show textarea
+        outputRenderer(hideAnim=true, hideText=false, text=response);
+    });
+}
+
+
 // --------------------------------------------------------------------------------
 // recognize button
 // --------------------------------------------------------------------------------
@@ -191,6 +285,18 @@ recognize.onclick = function(event) {
     // show animation and hide textarea
     outputRenderer(hideAnim=false, hideText=true, text='');
 
+    // transmit strokes drawn on canvas
+    if(options.uploadFormat == 'strokes') {
+        uploadStrokes();
+        return;
+    }
+
+    // transmit canvas as png bytes
+    if(options.uploadFormat == 'binary') {
+        canvas.toBlob(uploadBinary, 'image/png');
+        return;
+    }
+
     // convert canvas data to base64 encoded image data
     var canvasData = canvas.toDataURL('image/png');
 
@@ -262,6 +368,12 @@ upload.onclick = function(event) {
         // show animation and hide textarea
         outputRenderer(hideAnim=false, hideText=true, text='');
 
+        // transmit image file as it is
+        if(options.uploadFormat != 'base64') {
+            uploadBinary(imfile);
+            return;
+        }
+
         // read image file as base64 encoded image data
         reader.readAsDataURL(imfile);
     }
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+OCR back-end server application.
+Created on Mon Jul 10 11:00:00 2017
+Author: Prasun Roy | CVPRU-ISICAL (http://www.isical.ac.in/~cvpr)
+GitHub: https://github.com/prasunroy/ocr
+
+"""
+
+
+# imports
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+
+import cv2
+import numpy
+
+import config
+import samples
+
+from registry import ModelRegistry
+from registry import engines
+
+try:
+    from keras.utils import Sequence
+except ImportError:
+    Sequence = object
+
+
+# setup environment
+# ---- sample directories of recognition engines ----
+datasets = {'en-numbers': config.db_path_en_numbers,
+            'en-letters': config.db_path_en_letters,
+            'bn-numbers': config.db_path_bn_numbers,
+            'bn-letters': config.db_path_bn_letters,
+            'dv-numbers': config.db_path_dv_numbers,
+            'dv-letters': config.db_path_dv_letters}
+
+
+################################################################################
+
+# packed arrays of an engine
+def packed_files(engine):
+    name = engine.replace('-', '_')
+    
+    return (os.path.join(config.ppath, name + '_images.npy'),
+            os.path.join(config.ppath, name + '_labels.npy'))
+
+
+# latest modification time of the samples of a dataset
+def modified(db_path, n_class):
+    mtime = 0.0
+    
+    for label in range(n_class):
+        path = os.path.join(db_path, str(label))
+        if not os.path.isdir(path):
+            continue
+        mtime = max(mtime, os.path.getmtime(path))
+        for name in [samples.index_file, samples.shard_file]:
+            if os.path.isfile(os.path.join(path, name)):
+                mtime = max(mtime, os.path.getmtime(os.path.join(path, name)))
+    
+    return mtime
+
+
+# pack the samples of an engine once into memory-mapped uint8 arrays
+def pack(engine, force=False):
+    db_path = datasets[engine]
+    n_class = engines[engine][0]
+    (ifile, lfile) = packed_files(engine)
+    shape = config.i_shape[1:]
+    
+    # reuse packed arrays unless samples changed after packing
+    if not force and os.path.isfile(ifile) and os.path.isfile(lfile) and \
+       os.path.getmtime(ifile) >= modified(db_path, n_class):
+        return (ifile, lfile)
+    
+    if not os.path.isdir(config.ppath):
+        os.makedirs(config.ppath)
+    
+    # read labels one at a time into a growing array on disk
+    tfile = ifile + '.tmp'
+    labels = []
+    
+    with open(tfile, 'wb') as file:
+        for label in range(n_class):
+            path = os.path.join(db_path, str(label))
+            if not os.path.isdir(path):
+                continue
+            
+            for image in samples.load(path, shape):
+                if image.shape != tuple(shape):
+                    image = cv2.resize(image, (shape[1], shape[0]),
+                                       interpolation=cv2.INTER_AREA)
+                file.write(numpy.ascontiguousarray(image).tobytes())
+                labels.append(label)
+    
+    # wrap raw samples into an npy file that can be opened memory-mapped
+    n_samples = len(labels)
+    images = numpy.lib.format.open_memmap(ifile, mode='w+', dtype='uint8',
+                                          shape=(n_samples,) + tuple(shape))
+    if n_samples > 0:
+        images[:] = numpy.memmap(tfile, dtype='uint8', mode='r',
+                                 shape=images.shape)
+    images.flush()
+    del images
+    os.remove(tfile)
+    
+    numpy.save(lfile, numpy.array(labels, dtype='int32'))
+    
+    print('[DEBUG] packed {} samples of {} into {}'
+          .format(n_samples, engine, ifile))
+    
+    return (ifile, lfile)
+
+
+################################################################################
+
+# random affine distortion of a glyph
+def augment(image, random):
+    (h, w) = image.shape
+    angle = random.uniform(-10.0, 10.0)
+    scale = random.uniform(0.9, 1.1)
+    matrix = cv2.getRotationMatrix2D((w / 2.0, h / 2.0), angle, scale)
+    matrix[:, 2] += random.uniform(-3.0, 3.0, size=2)
+    
+    return cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+
+# shuffled batches streamed from memory-mapped packed arrays
+class PackedSequence(Sequence):
+    def __init__(self, ifile, lfile, index, n_class, batch_size,
+                 augmentation=True, seed=0):
+        self.ifile = ifile
+        self.lfile = lfile
+        self.index = numpy.array(index)
+        self.n_class = n_class
+        self.batch_size = batch_size
+        self.augmentation = augmentation
+        self.seed = seed
+        self.epoch = 0
+        self.images = None
+        self.random = None
+        self.pid = None
+        self.labels = numpy.load(lfile)
+        self.shuffle()
+    
+    def __len__(self):
+        return (len(self.index) + self.batch_size - 1) // self.batch_size
+    
+    # open arrays and seed augmentation once per worker process
+    def arrays(self):
+        if self.images is None or self.pid != os.getpid():
+            self.images = numpy.load(self.ifile, mmap_mode='r')
+            self.random = numpy.random.RandomState()
+            self.pid = os.getpid()
+        
+        return self.images
+    
+    # reorder samples for the next epoch (worker processes keep the order
+    # they were started with but still draw fresh augmentations)
+    def shuffle(self):
+        random = numpy.random.RandomState(self.seed + self.epoch)
+        self.order = self.index[random.permutation(len(self.index))]
+    
+    def on_epoch_end(self):
+        self.epoch += 1
+        self.shuffle()
+    
+    def __getitem__(self, i):
+        # sorted reads keep access to the memory map mostly sequential
+        batch = numpy.sort(self.order[i*self.batch_size:
+                                      (i+1)*self.batch_size])
+        images = self.arrays()[batch]
+        
+        if self.augmentation:
+            images = numpy.stack([augment(image, self.random)
+                                  for image in images])
+        
+        x = images[:, None].astype('float32') / 255.0
+        y = numpy.eye(self.n_class, dtype='float32')[self.labels[batch]]
+        
+        return (x, y)
+
+
+################################################################################
+
+# train or fine-tune the model of an engine writing its weights atomically
+def train(engine, mode='finetune', epochs=None, batch_size=None,
+          validation=0.1, workers=None, augmentation=True, output=None,
+          repack=False):
+    from keras.callbacks import ModelCheckpoint
+    from models import cnn
+    
+    (n_class, tfile, mfile, _) = engines[engine]
+    
+    # read configurations
+    if mode == 'train':
+        epochs = epochs or config.epoch_training
+        batch_size = batch_size or config.batch_training
+    else:
+        epochs = epochs or config.epoch_finetune
+        batch_size = batch_size or config.batch_finetune
+    workers = workers or multiprocessing.cpu_count()
+    output = output or tfile
+    
+    # split packed samples into training and validation sets
+    (ifile, lfile) = pack(engine, force=repack)
+    n_samples = len(numpy.load(lfile))
+    if n_samples == 0:
+        print('[DEBUG] no samples of {} in {}'.format(engine,
+                                                      datasets[engine]))
+        return None
+    
+    index = numpy.random.RandomState(0).permutation(n_samples)
+    n_valid = int(n_samples * validation)
+    train_data = PackedSequence(ifile, lfile, index[n_valid:], n_class,
+                                batch_size, augmentation)
+    valid_data = PackedSequence(ifile, lfile, index[:n_valid], n_class,
+                                batch_size, False) if n_valid > 0 else None
+    
+    # build model starting from current weights when fine-tuning
+    model = cnn(config.i_shape, n_class)
+    if mode == 'finetune':
+        wfile = ModelRegistry().wfile(engine)
+        if wfile is not None:
+            model.load_weights(wfile)
+    
+    # keep serving the previous weights until the best epoch is written
+    checkpoint = output + '.tmp'
+    monitor = 'loss' if valid_data is None else 'val_loss'
+    callbacks = [ModelCheckpoint(checkpoint, monitor=monitor,
+                                 save_best_only=True, save_weights_only=True)]
+    
+    # augment batches in worker processes while the model trains
+    model.fit_generator(train_data, steps_per_epoch=len(train_data),
+                        epochs=epochs, callbacks=callbacks,
+                        validation_data=valid_data,
+                        validation_steps=None if valid_data is None
+                        else len(valid_data),
+                        workers=workers, use_multiprocessing=workers > 1,
+                        max_queue_size=2 * workers)
+    
+    if not os.path.isfile(checkpoint):
+        print('[DEBUG] no improving epoch of {}, weights unchanged'
+              .format(engine))
+        return None
+    
+    os.rename(checkpoint, output)
+    print('[DEBUG] saved weights of {} to {}'.format(engine, output))
+    
+    return output
+
+
+################################################################################
+
+# main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pack samples and train or '
+                                     'fine-tune recognition engines')
+    parser.add_argument('mode', choices=['pack', 'train', 'finetune'])
+    parser.add_argument('--engine', nargs='+', default=list(engines),
+                        choices=engines)
+    parser.add_argument('--epochs', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--validation', type=float, default=0.1,
+                        help='fraction of samples held out for validation')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes preparing batches')
+    parser.add_argument('--no-augmentation', action='store_true')
+    parser.add_argument('--output', default=None,
+                        help='weights file (default: fine-tuned weights)')
+    parser.add_argument('--repack', action='store_true',
+                        help='pack samples even if packed arrays are current')
+    args = parser.parse_args()
+    
+    for engine in args.engine:
+        if args.mode == 'pack':
+            pack(engine, force=args.repack)
+        else:
+            train(engine, args.mode, args.epochs, args.batch_size,
+                  args.validation, args.workers, not args.no_augmentation,
+                  args.output, args.repack)